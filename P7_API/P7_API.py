@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, jsonify
-import pandas as pd
+from flask import Flask, abort, request, Response
+import numpy as np
+import os
+import atexit
+import tempfile
+import joblib
 
 from functions.P7_functions_API import *
+from functions.P7_functions_concurrency import ComputeExecutor, MicroBatcher, Overloaded
+from functions.P7_functions_model import ModelRegistry
+from functions.P7_functions_precomputed import PrecomputedResults
+from functions.P7_functions_response import dumps, json_response, PayloadCache
+from functions.P7_functions_store import CustomerStore, FeatureMatrix
+from functions.P7_functions_transform import DOMAIN_FEATURES
+from functions.P7_functions_warmup import AccessLog, WarmUp
 
 # Suppress warnings
 import warnings
@@ -11,6 +22,160 @@ warnings.filterwarnings('ignore')
 
 P7_API = Flask(__name__)
 
+# Data of the new customers, loaded once per worker and indexed by SK_ID_CURR
+customer_store = CustomerStore("data/data_new_customer.parquet")
+
+# Model and explainer, loaded once and shared by the routes (and by the workers with gunicorn --preload).
+# The shapley values are calculated by LightGBM ("native"), or by the shap package with "shap"
+name_model_file = "data/model_lgbm.pkl"
+explanation_backend = "native"
+model_registry = ModelRegistry(explanation_backend=explanation_backend)
+model_registry.load(name_model_file)
+
+# Features of the new customers in a float32 matrix mapped in memory, shared by the workers, for the live scoring
+feature_matrix = FeatureMatrix("data/features_new_customer.npy", "data/features_new_customer_index.pkl")
+
+# Scores and shapley values calculated by P7_preprocessing.py, live computation if missing or outdated
+precomputed_results = PrecomputedResults("data/precomputed_results.pkl")
+
+# Batch route: maximum number of ids per request and number of customers scored at once in the NDJSON stream
+batch_max_size = 50000
+batch_chunk_size = 1000
+
+# Search route: maximum number of ids per page
+search_max_limit = 100
+
+# Preprocessing fitted by P7_preprocessing.py, used to score new applications sent to the API
+name_pipeline_file = "data/preprocessing_pipeline.pkl"
+preprocessing_pipeline = joblib.load(name_pipeline_file) if os.path.exists(name_pipeline_file) else None
+score_max_size = 1000
+# Fields of application_test.csv required to score an application: the amounts and the days of the domain features.
+# The other fields can be missing (or None), they are imputed like in the data of the new customers
+score_required_fields = sorted({col for name, numerator, denominator in DOMAIN_FEATURES
+                                for col in (numerator, denominator)})
+
+# Responses of the customers serialized once (json bytes and etag), for the model and the data currently served.
+# The 10000 last responses are kept in memory by each worker, and shared by the workers in a SQLite file (None to
+# keep them in memory only)
+payload_cache_path = os.path.join(tempfile.gettempdir(), "p7_api_payload_cache.sqlite")
+payload_cache = PayloadCache(max_size=10000, path=payload_cache_path, max_disk_size=100000)
+# Format of the responses, part of the version of the cache: to increase when the code changes the content of the
+# responses (fields, layout...), so the SQLite file written by the previous code (kept between restarts) is not served
+payload_format_version = 1
+
+# Customers requested, logged to warm up the payload cache with the 200 most requested customers at the next start
+access_log = AccessLog("data/access_log.txt")
+atexit.register(access_log.flush)
+warm_up = WarmUp()
+warm_up_top_n = 200
+# Number of shapley values of each side requested by the dashboard (?top_k=)
+warm_up_top_k = 5
+# Above this top_k every shapley value is returned: the larger top_k are clamped, one key of the cache per response
+shap_max_top_k = (len(SHAP_FEATURES) + len(SHAP_CATEGORIES) + 1) // 2
+
+# Predictions and shapley values run in a bounded pool of threads, one per core, shared by the threads of the worker
+# (gunicorn gthread). Above 32 computations waiting, the requests are refused with 503 and Retry-After.
+compute_executor = ComputeExecutor(max_workers=os.cpu_count(), max_pending=32, timeout=30, retry_after=1)
+
+
+@P7_API.errorhandler(Overloaded)
+def overloaded(error):
+    """
+    Backpressure: the queue of the computations is full, the client tries again later
+    """
+    response = json_response(dumps({"error": "overloaded", "retry_after": error.retry_after}))
+    response.status_code = 503
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+# Micro-batching (opt-in): the live scores and shapley values of the customers requested at the same time are
+# computed in one call to the model, after a window of 2 ms
+micro_batching = False
+micro_batching_window_ms = 2
+micro_batching_max_size = 64
+
+
+def get_customer(customer_id):
+    """
+    Return the data of a customer from the store, 404 if the customer is unknown
+    :param customer_id: (int) SK_ID_CURR of the customer
+    :return: dataframe of one row
+    """
+    customer_store.reload_if_changed()
+    if customer_id not in customer_store:
+        abort(404)
+    return customer_store.get(customer_id)
+
+
+def precomputed_is_valid():
+    """
+    :return: True if the precomputed results match the model and the data currently served
+    """
+    precomputed_results.reload_if_changed()
+    return precomputed_results.is_valid(model_registry.get(name_model_file).file_hash, customer_store.file_hash)
+
+
+def feature_matrix_is_valid():
+    """
+    :return: True if the feature matrix matches the data currently served
+    """
+    feature_matrix.reload_if_changed()
+    return feature_matrix.is_valid(customer_store.file_hash)
+
+
+def scoring_customers(df_customers):
+    """
+    Score a group of customers: precomputed scores when available, one call to the model for the others
+    (on the rows of the feature matrix, without dataframe, when it is valid)
+    :param df_customers: dataframe of the customers (rows of the customer store)
+    :return: dataframe of the API indexed by SK_ID_CURR
+    """
+    if precomputed_is_valid():
+        scores = precomputed_results.scores_many(list(df_customers["SK_ID_CURR"]))
+    else:
+        scores = np.full(len(df_customers), np.nan)
+
+    missing = np.isnan(scores)
+    if missing.any():
+        model_lgbm = model_registry.model(name_model_file)
+        if feature_matrix_is_valid():
+            preds = model_lgbm.predict_proba(feature_matrix.get(df_customers["SK_ID_CURR"][missing]))[:, 1]
+            scores[missing] = ((1 - preds) * 100).round()
+        else:
+            df_live = lgbm_scoring_prediction(df_customers[missing], model_lgbm=model_lgbm)
+            scores[missing] = df_live["SCORING_PREDICT"].to_numpy()
+
+    df_scoring = df_customers.copy()
+    df_scoring["SCORING_PREDICT"] = scores
+    return data_for_api(df_scoring)
+
+
+def scoring_batch(list_customer_id):
+    """
+    Answers of the customer route for a batch of the micro-batcher, scored together
+    :param list_customer_id: list of SK_ID_CURR (known by the customer store)
+    :return: list of dict {customer_id: data of the API} in the order of list_customer_id
+    """
+    records = scoring_customers(customer_store.get_many(list(dict.fromkeys(list_customer_id)))).to_dict('index')
+    return [{cust_id: records[cust_id]} for cust_id in list_customer_id]
+
+
+def shap_batch(list_customer_id):
+    """
+    Answers of the shapley values route for a batch of the micro-batcher, one call to the explainer
+    :param list_customer_id: list of SK_ID_CURR (known by the customer store)
+    :return: list of dict {customer_id: shapley values} in the order of list_customer_id
+    """
+    df_customers = customer_store.get_many(list(dict.fromkeys(list_customer_id)))
+    records = shapley_values(df_customers, explainer=model_registry.explainer(name_model_file)).to_dict('index')
+    return [{cust_id: records[cust_id]} for cust_id in list_customer_id]
+
+
+customer_batcher = MicroBatcher(scoring_batch, window_ms=micro_batching_window_ms,
+                                max_batch_size=micro_batching_max_size)
+shap_batcher = MicroBatcher(shap_batch, window_ms=micro_batching_window_ms, max_batch_size=micro_batching_max_size)
+
 
 @P7_API.route("/")
 def hello():
@@ -20,35 +185,301 @@ def hello():
                                 "OpenClassrooms",
                  "Route_1": "https://p7-oc-api.herokuapp.com/api/new_customer/index_list/",
                  "Route_2": "https://p7-oc-api.herokuapp.com/api/new_customer/<i>customer_id<i>/",
-                 "Route_3": "https://p7-oc-api.herokuapp.com/api/new_customer/shap_values/<i>customer_id<i>/"}
-    return jsonify(hello_api)
+                 "Route_3": "https://p7-oc-api.herokuapp.com/api/new_customer/shap_values/<i>customer_id<i>/",
+                 "Route_4": "https://p7-oc-api.herokuapp.com/api/new_customer/batch/ (POST)",
+                 "Route_5": "https://p7-oc-api.herokuapp.com/api/new_customer/search/?q=<i>prefix<i>",
+                 "Route_6": "https://p7-oc-api.herokuapp.com/api/score/ (POST)",
+                 "Route_7": "https://p7-oc-api.herokuapp.com/api/stats/",
+                 "Route_8": "https://p7-oc-api.herokuapp.com/ready"}
+    return json_response(dumps(hello_api))
+
+
+def served_hashes():
+    """
+    :return: tuple (format of the responses, hash of the model, hash of the data) currently served, part of the keys of
+    the payload cache (the responses of the other formats, models and data are removed from the cache)
+    """
+    customer_store.reload_if_changed()
+    hashes = payload_format_version, model_registry.get(name_model_file).file_hash, customer_store.file_hash
+    payload_cache.set_version(hashes)
+    return hashes
+
+
+def shap_top_k_customer(customer_id, top_k):
+    """
+    The top_k lowest and highest shapley values of a customer, from the precomputed results or calculated on the row of
+    the feature matrix, without dataframe of the shapley values
+    :param customer_id: (int) SK_ID_CURR of the customer
+    :param top_k: (int) number of shapley values on each side
+    :return: dict {customer_id: {"feature": [...], "shap_value": [...], "value": [...]}}
+    """
+    if feature_matrix_is_valid() and customer_id in customer_store:
+        columns = feature_matrix.columns
+        features = np.asarray(feature_matrix.get([customer_id])[0], dtype=np.float64)
+    else:
+        X = get_customer(customer_id).drop(columns=["SK_ID_CURR", "TARGET"], errors="ignore")
+        columns = list(X.columns)
+        features = X.to_numpy(dtype=np.float64)[0]
+
+    shap_customer = precomputed_results.shap(customer_id) if precomputed_is_valid() else None
+    if shap_customer is not None:
+        shap_names = list(shap_customer)
+        shap_row = np.array(list(shap_customer.values()))
+    else:
+        explainer = model_registry.explainer(name_model_file)
+        shap_values = compute_executor.run(lambda: explainer.shap_values(features[None, :])[0])
+        shap_names = SHAP_FEATURES + SHAP_CATEGORIES
+        shap_row = shap_select(shap_values, columns)[0]
+    return {customer_id: shap_top_k(shap_names, shap_row, features, columns, k=top_k)}
+
+
+def customer_payload(customer_id):
+    """
+    Serialized answer of the customer route, from the payload cache or computed (404 if the customer is unknown)
+    :param customer_id: (int) SK_ID_CURR of the customer
+    :return: tuple (json bytes, etag)
+    """
+    def build():
+        if micro_batching:
+            if customer_id not in customer_store:
+                abort(404)
+            return customer_batcher.submit(customer_id)
+        return compute_executor.run(lambda: scoring_customers(get_customer(customer_id)).to_dict('index'))
+
+    return payload_cache.get_or_build(("customer",) + served_hashes() + (customer_id,), build)
+
+
+def shap_values_payload(customer_id, top_k=None):
+    """
+    Serialized answer of the shapley values route, from the payload cache or computed (404 if the customer is unknown)
+    :param customer_id: (int) SK_ID_CURR of the customer
+    :param top_k: (int) number of the lowest and highest shapley values, None for all the shapley values
+    :return: tuple (json bytes, etag)
+    """
+    if top_k is not None:
+        return payload_cache.get_or_build(("shap_top_k",) + served_hashes() + (customer_id, top_k),
+                                          lambda: shap_top_k_customer(customer_id, top_k))
+
+    def build():
+        df_customer_id = get_customer(customer_id)
+        if precomputed_is_valid():
+            shap_customer = precomputed_results.shap(customer_id)
+            if shap_customer is not None:
+                return {customer_id: shap_customer}
+        if micro_batching:
+            return shap_batcher.submit(customer_id)
+        explainer = model_registry.explainer(name_model_file)
+        return compute_executor.run(lambda: shapley_values(df_customer_id, explainer=explainer).to_dict('index'))
+
+    return payload_cache.get_or_build(("shap_values",) + served_hashes() + (customer_id,), build)
+
+
+def warm_up_model():
+    """
+    Warm-up step: a first predict_proba and shapley values on 100 customers (numpy array and dataframe paths)
+    """
+    list_customer_id = list(customer_store.index_list[:100])
+    df_customers = customer_store.get_many(list_customer_id)
+    loaded = model_registry.get(name_model_file)
+    if feature_matrix_is_valid():
+        X = np.asarray(feature_matrix.get(list_customer_id), dtype=np.float64)
+        loaded.model.predict_proba(X)
+        loaded.explainer.shap_values(X)
+    lgbm_scoring_prediction(df_customers, model_lgbm=loaded.model)
+    shapley_values(df_customers, explainer=loaded.explainer)
+
+
+def warm_up_customers():
+    """
+    Warm-up step: answers of the most requested customers of the access log put in the payload cache
+    """
+    for customer_id in access_log.top(warm_up_top_n):
+        if customer_id in customer_store:
+            customer_payload(customer_id)
+            shap_values_payload(customer_id)
+            shap_values_payload(customer_id, top_k=warm_up_top_k)
+
+
+def start_warm_up():
+    """
+    Start the warm-up of the worker in a background thread: /ready answers 503 until it is finished.
+    Called after the fork of each gunicorn worker (gunicorn.conf.py), LightGBM is never run in the master process.
+    """
+    warm_up.start([("artifacts", served_hashes),
+                   ("model", warm_up_model),
+                   ("customers", warm_up_customers)])
+
+
+@P7_API.route("/ready")
+def ready():
+    """
+    Readiness of the worker: 503 until the warm-up (model, explainer, caches) is finished. The first call starts the
+    warm-up if it was not started (API run without gunicorn.conf.py).
+    """
+    if not warm_up.is_ready():
+        start_warm_up()
+        response = json_response(dumps({"ready": False}))
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+        return response
+    return json_response(dumps({"ready": True}))
 
 
 @P7_API.route("/api/new_customer/index_list/")
 def get_new_customer_index():
-    data_new_customer = pd.read_csv("data/data_new_customer.csv").drop(columns=["Unnamed: 0"])
-    index_customer = list(data_new_customer["SK_ID_CURR"])
-    return jsonify(index_customer)
+    body, etag = payload_cache.get_or_build(("index_list",) + served_hashes(), lambda: customer_store.index_list)
+    return json_response(body, etag)
+
+
+@P7_API.route("/api/new_customer/search/")
+def search_new_customer_index():
+    """
+    Search customer ids by prefix (?q=1000) and/or range (?min=100001&max=100100), paginated with ?limit= and ?offset=
+    """
+    prefix = request.args.get("q", "").strip() or None
+    # Only ASCII digits: str.isdigit() also accepts other digits ("²"...) that int() does not convert
+    if prefix is not None and not (prefix.isascii() and prefix.isdigit()):
+        abort(400)
+    # Parameters that are not integers are ignored
+    id_min = request.args.get("min", type=int)
+    id_max = request.args.get("max", type=int)
+    limit = min(max(request.args.get("limit", default=20, type=int), 0), search_max_limit)
+    offset = max(request.args.get("offset", default=0, type=int), 0)
+
+    customer_store.reload_if_changed()
+    total, page = customer_store.search(prefix=prefix, id_min=id_min, id_max=id_max, limit=limit,
+                                        offset=offset)
+    return json_response(dumps({"total": total, "offset": offset, "customer_ids": page}))
 
 
 @P7_API.route("/api/new_customer/<int:customer_id>/")
 def get_data_new_customer_id(customer_id):
-    data_new_customer = pd.read_csv("data/data_new_customer.csv").drop(columns=["Unnamed: 0"])
-    df_customer_id = data_new_customer[data_new_customer["SK_ID_CURR"] == customer_id]
-    df_scoring = lgbm_scoring_prediction(df_customer_id, name_model_file="data/model_lgbm.pkl")
-    df_api = data_for_api(df_scoring)
-    dict_api = df_api.to_dict('index')
-    return jsonify(dict_api)
+    access_log.record(customer_id)
+    body, etag = customer_payload(customer_id)
+    return json_response(body, etag)
+
+
+@P7_API.route("/api/new_customer/batch/", methods=["POST"])
+def get_data_new_customer_batch():
+    """
+    Score a list of customers. The body is a json {"customer_ids": [...]} (or directly the list).
+    The answer is a columnar json {"SK_ID_CURR": [...], "SCORING_PREDICT": [...], ..., "missing": [...]}
+    or, with ?format=ndjson (or Accept: application/x-ndjson), a stream of one json line per customer
+    ended by the line {"missing": [...]}.
+    """
+    body = request.get_json(force=True, silent=True)
+    if isinstance(body, dict):
+        body = body.get("customer_ids")
+    if not isinstance(body, list):
+        abort(400)
+    try:
+        list_customer_id = [int(cust_id) for cust_id in body]
+    except (TypeError, ValueError):
+        abort(400)
+    if len(list_customer_id) > batch_max_size:
+        abort(413)
+
+    customer_store.reload_if_changed()
+    list_found = [cust_id for cust_id in list_customer_id if cust_id in customer_store]
+    list_missing = [cust_id for cust_id in list_customer_id if cust_id not in customer_store]
+
+    ndjson = request.args.get("format") == "ndjson" or \
+        request.accept_mimetypes.best == "application/x-ndjson"
+
+    if not ndjson:
+        columns_api = {}
+        if list_found:
+            df_api = compute_executor.run(scoring_customers, customer_store.get_many(list_found)).reset_index()
+            # numeric columns serialized from the numpy arrays, without list of python objects
+            columns_api = {col: df_api[col].to_numpy() if df_api[col].dtype.kind in "biuf" else df_api[col].tolist()
+                           for col in df_api}
+        columns_api["missing"] = list_missing
+        return json_response(dumps(columns_api))
+
+    # The first chunk is scored before the answer starts (503 if the API is overloaded), the next chunks wait for
+    # a free slot: a stream already started is not cut
+    df_first = compute_executor.run(scoring_customers, customer_store.get_many(list_found[:batch_chunk_size])) \
+        if list_found else None
+
+    def generate():
+        for i in range(0, len(list_found), batch_chunk_size):
+            if i == 0:
+                df_api = df_first
+            else:
+                df_api = compute_executor.run(scoring_customers,
+                                              customer_store.get_many(list_found[i:i + batch_chunk_size]), block=True)
+            yield df_api.reset_index().to_json(orient="records", lines=True).rstrip("\n").encode() + b"\n"
+        yield dumps({"missing": list_missing}) + b"\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
 
 
 @P7_API.route("/api/new_customer/shap_values/<int:customer_id>/")
 def get_shap_values_new_customer_id(customer_id):
-    data_new_customer = pd.read_csv("data/data_new_customer.csv").drop(columns=["Unnamed: 0"])
-    df_customer_id = data_new_customer[data_new_customer["SK_ID_CURR"] == customer_id]
-    df_shap = shapley_values(df_customer_id, name_model_file="data/model_lgbm.pkl")
-    dict_api = df_shap.to_dict('index')
-    return jsonify(dict_api)
+    """
+    Shapley values of a customer. With ?top_k=5, only the 5 lowest and the 5 highest shapley values with the values of
+    their features: {customer_id: {"feature": [...], "shap_value": [...], "value": [...]}} sorted by shapley value.
+    """
+    top_k = request.args.get("top_k", type=int)
+    access_log.record(customer_id)
+    if top_k is not None:
+        top_k = min(max(top_k, 1), shap_max_top_k)
+    body, etag = shap_values_payload(customer_id, top_k=top_k)
+    return json_response(body, etag)
+
+
+@P7_API.route("/api/score/", methods=["POST"])
+def score_new_application():
+    """
+    Score raw applications (columns of application_test.csv) not in the data of the new customers.
+    The body is one application {column: value, ...} or a list of applications, add ?shap=true for the shapley values.
+    The answer is {"SK_ID_CURR", "SCORING_PREDICT"(, "shap_values")} or the list of them.
+    An application without one of the fields score_required_fields is refused (400) with the list of the missing fields
+    ({position in the list: [fields]} for a list of applications).
+    """
+    if preprocessing_pipeline is None:
+        abort(503)
+    body = request.get_json(force=True, silent=True)
+    list_record = body if isinstance(body, list) else [body]
+    if not list_record or not all(isinstance(record, dict) for record in list_record):
+        abort(400)
+    if len(list_record) > score_max_size:
+        abort(413)
+    # Refused instead of scored on imputed values only
+    missing = {i: [field for field in score_required_fields if record.get(field) is None]
+               for i, record in enumerate(list_record)}
+    missing = {i: fields for i, fields in missing.items() if fields}
+    if missing:
+        response = json_response(dumps({"error": "missing fields",
+                                        "missing_fields": missing if isinstance(body, list) else missing[0]}))
+        response.status_code = 400
+        return response
+
+    with_shap = request.args.get("shap", "false").lower() in ("1", "true", "yes")
+    loaded = model_registry.get(name_model_file)
+    try:
+        results = compute_executor.run(score_records, list_record, preprocessing_pipeline, loaded.model,
+                                       explainer=loaded.explainer if with_shap else None)
+    except (TypeError, ValueError):
+        abort(400)
+    return json_response(dumps(results if isinstance(body, list) else results[0]))
+
+
+@P7_API.route("/api/stats/")
+def get_stats():
+    """
+    State of the warm-up, counters of the cache of the responses (hit ratio, evictions), of the executor of the
+    computations and of the micro-batchers (histograms of the batch sizes and of the waiting times in the queue)
+    """
+    stats = {"warm_up": warm_up.stats(),
+             "payload_cache": payload_cache.stats(),
+             "compute_executor": compute_executor.stats(),
+             "micro_batching": {"enabled": micro_batching,
+                                "customer": customer_batcher.stats(),
+                                "shap_values": shap_batcher.stats()}}
+    return json_response(dumps(stats))
 
 
 if __name__ == "__main__":
+    start_warm_up()
     P7_API.run(debug=True)
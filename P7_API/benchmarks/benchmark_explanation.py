@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the explanation backends of the API: shapley values calculated by LightGBM ("native", pred_contrib) or
+by the shap package ("shap", TreeExplainer).
+Run from the folder P7_API: python benchmarks/benchmark_explanation.py
+"""
+# import
+import os
+import sys
+import time
+import tracemalloc
+
+import joblib
+import numpy as np
+
+path_api = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, path_api)
+from functions.P7_functions_explainer import make_explainer
+
+# Suppress warnings
+import warnings
+
+warnings.filterwarnings('ignore')
+
+BACKENDS = ["native", "shap"]
+N_ROWS = [1, 100, 10000]
+
+
+def load_features(n_rows):
+    """
+    Rows of the feature matrix of the new customers, repeated if there are less customers than n_rows
+    :param n_rows: (int) number of rows
+    :return: float64 array (n_rows, features)
+    """
+    features = np.load(os.path.join(path_api, "data", "features_new_customer.npy"), mmap_mode="r")
+    rows = np.arange(n_rows) % len(features)
+    return np.asarray(features[rows], dtype=np.float64)
+
+
+def measure(explainer, X, repeat):
+    """
+    Latency and memory of the shapley values of X
+    :param explainer: explainer (make_explainer())
+    :param X: 2D array of the features
+    :param repeat: (int) number of calls, the latency is the median
+    :return: tuple (median latency in ms, peak of the memory allocated during one call in MB, shapley values)
+    """
+    tracemalloc.start()
+    shap_values = explainer.shap_values(X)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    list_latency = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        explainer.shap_values(X)
+        list_latency.append(time.perf_counter() - start)
+    return 1000 * np.median(list_latency), peak / 1e6, np.asarray(shap_values[0])
+
+
+def benchmark():
+    """
+    Print the latency and the memory of each backend for 1, 100 and 10k rows, and the difference of their values
+    :return: no return
+    """
+    model_lgbm = joblib.load(os.path.join(path_api, "data", "model_lgbm.pkl"))
+
+    explainers = {}
+    for backend in BACKENDS:
+        # The time to build the explainer includes the import of shap for the backend "shap"
+        start = time.perf_counter()
+        explainers[backend] = make_explainer(model_lgbm, backend=backend)
+        print("%-6s explainer built in %.1f ms" % (backend, 1000 * (time.perf_counter() - start)))
+
+    print("%-6s %8s %12s %12s %12s" % ("", "rows", "latency ms", "memory MB", "max diff"))
+    for n_rows in N_ROWS:
+        X = load_features(n_rows)
+        repeat = max(3, 1000 // n_rows)
+        reference = None
+        for backend in BACKENDS:
+            latency, memory, shap_values = measure(explainers[backend], X, repeat)
+            if reference is None:
+                reference = shap_values
+            print("%-6s %8d %12.3f %12.2f %12.2e" % (backend, n_rows, latency, memory,
+                                                     np.abs(shap_values - reference).max()))
+
+
+if __name__ == "__main__":
+    benchmark()
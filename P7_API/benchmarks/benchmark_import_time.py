@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Import time of the modules of the API (python -X importtime), to follow the start time of the workers.
+Run from the folder P7_API: python benchmarks/benchmark_import_time.py [module ...]
+(from the root of the project for the modules of P7_functions, e.g. P7_functions.P7_functions_data_for_API)
+"""
+# import
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+# Modules measured by default: the functions of the API, then the whole API (data and model loaded at import)
+MODULES = ["functions.P7_functions_API",
+           "functions.P7_functions_store",
+           "functions.P7_functions_model",
+           "P7_API"]
+N_TOP = 10
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+def import_time(module):
+    """
+    Import a module in a new python process with -X importtime
+    :param module: (str) name of the module
+    :return: tuple (wall time of the process in s, list of tuples (self us, cumulative us, depth, imported module))
+    """
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                             stderr=subprocess.PIPE, universal_newlines=True)
+    wall_time = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError("import of %s failed:\n%s" % (module, process.stderr[-2000:]))
+
+    list_import = []
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            list_import.append((int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2,
+                                match.group(4)))
+    return wall_time, list_import
+
+
+def report(module):
+    """
+    Print the import time of a module and the packages which cost the most (self time of all their modules)
+    :param module: (str) name of the module
+    :return: no return
+    """
+    wall_time, list_import = import_time(module)
+    cumulative = sum(cumulative_us for self_us, cumulative_us, depth, name in list_import if depth == 0)
+
+    packages = defaultdict(int)
+    for self_us, cumulative_us, depth, name in list_import:
+        packages[name.split(".")[0]] += self_us
+
+    print("%s: imports %.3f s, process %.3f s, %d modules" % (module, cumulative / 1e6, wall_time, len(list_import)))
+    for package, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:N_TOP]:
+        print("    %-30s %8.1f ms" % (package, self_us / 1000))
+    heavy = [package for package in ["shap", "sklearn", "lightgbm", "numba", "matplotlib"] if package in packages]
+    print("    heavy packages loaded: %s" % (", ".join(heavy) if heavy else "none"))
+
+
+if __name__ == "__main__":
+    for name_module in sys.argv[1:] or MODULES:
+        report(name_module)
@@ -1,24 +1,32 @@
 # import
 import numpy as np
 import pandas as pd
-# Modeling
-import lightgbm as lgb
-import shap
+# Modeling (lightgbm is imported when the model is unpickled, shap only by make_explainer(backend="shap"))
 import joblib
+# Utils
+import re
+from functools import lru_cache
+
+# Preprocessing of new applications, shared with P7_functions_preprocessing.py
+from functions.P7_functions_transform import transform_record
+# Explanation of the scores, shared with P7_functions_ML.py
+from functions.P7_functions_explainer import make_explainer
 
 
 #########################################
 # MACHINE LEARNING
 
-def lgbm_scoring_prediction(df, name_model_file="model_lgbm.pkl"):
+def lgbm_scoring_prediction(df, name_model_file="model_lgbm.pkl", model_lgbm=None):
     """
         Apply the model name_model_file to a dataframe and return the same dataframe with the prediction in %
         :param df: Dataframe
         :param name_model_file: name of the model (pickel file .pkl)
+        :param model_lgbm: model already loaded, if None the model is loaded from name_model_file
         :return: dataframe df with the prediction of the model
         """
 
-    model_lgbm = joblib.load(name_model_file)
+    if model_lgbm is None:
+        model_lgbm = joblib.load(name_model_file)
 
     # Prepared datas
     try:
@@ -47,23 +55,41 @@ def shap_to_categ(data_dummies, categ):
         :return: a list of shapley values than can be store in df[column]
         """
 
-    df = data_dummies.filter(regex=categ)
-    df_abs = df.abs()
-    max_loc = df_abs.idxmax(axis="columns")
-    max_shap = [df.loc[id_cust, max_loc[id_cust]] for id_cust in df.index]
-    return max_shap
+    return list(shap_from_dummies(data_dummies.to_numpy(), data_dummies.columns, [categ])[categ])
+
+
+# Variables of the shapley values sent by the API: numerical variables and categorical variables (one hot encoded)
+SHAP_FEATURES = ["AMT_GOODS_PRICE",
+                 "AMT_CREDIT",
+                 "AMT_ANNUITY",
+                 "AMT_INCOME_TOTAL",
+                 "ANNUITY_INCOME_PERCENT",
+                 "CREDIT_TERM",
+                 "DAYS_BIRTH",
+                 "DAYS_EMPLOYED",
+                 "DAYS_EMPLOYED_PERCENT",
+                 "REGION_POPULATION_RELATIVE",
+                 "CNT_CHILDREN"]
+
+SHAP_CATEGORIES = ["CODE_GENDER",
+                   "NAME_INCOME_TYPE",
+                   "NAME_EDUCATION_TYPE",
+                   "NAME_FAMILY_STATUS",
+                   "NAME_HOUSING_TYPE",
+                   "ORGANIZATION_TYPE",
+                   "OCCUPATION_TYPE"]
 
 
-def shapley_values(df, name_model_file="model_lgbm.pkl"):
+def shapley_values(df, name_model_file="model_lgbm.pkl", explainer=None, backend="native"):
     """
         Calculate shapley values of a dataframe for a model
         :param df: dataframe
         :param name_model_file: str of the name of the machine learning model (pickel file .pkl)
+        :param explainer: explainer already built (make_explainer()), if None it is built from name_model_file
+        :param backend: (str) backend of the explainer built if explainer is None, "native" or "shap"
         :return: dataframe of the shapley values
         """
 
-    model_lgbm = joblib.load(name_model_file)
-
     # Prepared datas
     X = df.set_index("SK_ID_CURR")
     try:
@@ -71,40 +97,153 @@ def shapley_values(df, name_model_file="model_lgbm.pkl"):
     except KeyError:
         pass
 
-    explainer = shap.TreeExplainer(model_lgbm)
+    if explainer is None:
+        model_lgbm = joblib.load(name_model_file)
+        explainer = make_explainer(model_lgbm, backend=backend)
     shap_values = explainer.shap_values(X)
     shap_values_df = pd.DataFrame(shap_values[0], index=X.index, columns=X.columns)
 
-    feature_selection = ["AMT_GOODS_PRICE",
-                         "AMT_CREDIT",
-                         "AMT_ANNUITY",
-                         "AMT_INCOME_TOTAL",
-                         "ANNUITY_INCOME_PERCENT",
-                         "CREDIT_TERM",
-                         "DAYS_BIRTH",
-                         "DAYS_EMPLOYED",
-                         "DAYS_EMPLOYED_PERCENT",
-                         "REGION_POPULATION_RELATIVE",
-                         "CNT_CHILDREN"]
-
-    categories = ["CODE_GENDER",
-                  "NAME_INCOME_TYPE",
-                  "NAME_EDUCATION_TYPE",
-                  "NAME_FAMILY_STATUS",
-                  "NAME_HOUSING_TYPE",
-                  "ORGANIZATION_TYPE",
-                  "OCCUPATION_TYPE"]
-
-    shap_values_df_select = shap_values_df[feature_selection]
+    shap_values_df_select = shap_values_df[SHAP_FEATURES]
 
-    for categ in categories:
-        shap_values_df_select[categ] = shap_to_categ(shap_values_df, categ)
+    shap_categ = shap_from_dummies(shap_values[0], X.columns, SHAP_CATEGORIES)
+    for categ in SHAP_CATEGORIES:
+        shap_values_df_select[categ] = shap_categ[categ]
 
     return shap_values_df_select
 
 
 #############################################
 # FOR API
+# Index of the dummies columns of the categorical variables
+@lru_cache(maxsize=32)
+def categ_column_groups(columns, categories):
+    """
+        Index the dummies columns of each categorical variable, calculated once for a layout of columns
+        :param columns: tuple of the columns of the dataframe with dummies variables
+        :param categories: tuple of the names of the variables with dummies
+        :return: array of the positions of the dummies columns grouped by variable and
+        list of tuples (name of the variable, start and end of its group in the positions, array of its categories)
+        """
+
+    positions = []
+    groups = []
+    for categ in categories:
+        start = len(positions)
+        columns_categ = [(i, col) for i, col in enumerate(columns) if re.search(categ, col)]
+        positions += [i for i, col in columns_categ]
+        labels = np.array([col.replace(categ + '_', '') for i, col in columns_categ], dtype=object)
+        groups.append((categ, start, len(positions), labels))
+    return np.array(positions, dtype=np.int64), tuple(groups)
+
+
+def dummies_argmax(values, groups, absolute=False):
+    """
+        Position and value of the maximum of each group of dummies columns, for all the rows at once
+        :param values: 2D array, the columns are the dummies columns in the order of categ_column_groups
+        :param groups: groups returned by categ_column_groups
+        :param absolute: if True the maximum is calculated on the absolute values
+        :return: dict {name of the variable: (array of the position of the max in the group, array of the max)}
+        """
+
+    results = {}
+    for categ, start, end, labels in groups:
+        if start == end:
+            results[categ] = (None, np.full(len(values), np.nan))
+            continue
+        values_categ = values[:, start:end]
+        loc_max = (np.abs(values_categ) if absolute else values_categ).argmax(axis=1)
+        results[categ] = (loc_max, np.take_along_axis(values_categ, loc_max[:, None], axis=1)[:, 0])
+    return results
+
+
+def categ_from_dummies(data_dummies, categories):
+    """
+        Create the categorical variables from their dummies variables
+        :param data_dummies: dataframe with variables in one hot encoding
+        :param categories: list of the names of the variables
+        :return: dict {name of the variable: array of the categories which can be store in a df[column]}
+        """
+
+    positions, groups = categ_column_groups(tuple(data_dummies.columns), tuple(categories))
+    values = data_dummies.iloc[:, positions].to_numpy(dtype=np.float64)
+    results = {}
+    for (categ, start, end, labels), (loc_max, max_values) in zip(groups, dummies_argmax(values, groups).values()):
+        results[categ] = max_values if loc_max is None else labels[loc_max]
+    return results
+
+
+def shap_from_dummies(shap_values, columns, categories):
+    """
+        Maximum shapley values (in absolute value) of the dummies variables of several categorical variables
+        :param shap_values: 2D array of the shapley values with dummies variables
+        :param columns: columns of shap_values
+        :param categories: list of the names of the variables with dummies
+        :return: dict {name of the variable: array of shapley values which can be store in a df[column]}
+        """
+
+    positions, groups = categ_column_groups(tuple(columns), tuple(categories))
+    results = dummies_argmax(shap_values[:, positions], groups, absolute=True)
+    return {categ: max_values for categ, (loc_max, max_values) in results.items()}
+
+
+def shap_select(shap_values, columns):
+    """
+        Shapley values sent by the API (SHAP_FEATURES then SHAP_CATEGORIES) from the shapley values with dummies
+        variables, on numpy arrays without dataframe
+        :param shap_values: 2D array of the shapley values with dummies variables
+        :param columns: columns of shap_values
+        :return: 2D array of the shapley values, columns in the order SHAP_FEATURES + SHAP_CATEGORIES
+        """
+
+    feature_index = {col: i for i, col in enumerate(columns)}
+    shap_categ = shap_from_dummies(shap_values, columns, SHAP_CATEGORIES)
+    return np.column_stack([shap_values[:, [feature_index[col] for col in SHAP_FEATURES]]] +
+                           [shap_categ[categ] for categ in SHAP_CATEGORIES])
+
+
+def feature_values_for_api(feature_values, columns):
+    """
+        Values of the features of the shapley values for one customer, as sent by the customer route (rounded like
+        data_for_api, categories instead of dummies)
+        :param feature_values: 1D array of the features of the customer with dummies variables
+        :param columns: columns of feature_values
+        :return: dict {feature: value}
+        """
+
+    feature_index = {col: i for i, col in enumerate(columns)}
+    numeric_values = np.asarray([feature_values[feature_index[col]] for col in SHAP_FEATURES], dtype=np.float64)
+    numeric_values = np.select([numeric_values > 1, numeric_values <= 1],
+                               [numeric_values.round(0), numeric_values.round(2)])
+    values = dict(zip(SHAP_FEATURES, numeric_values.tolist()))
+
+    positions, groups = categ_column_groups(tuple(columns), tuple(SHAP_CATEGORIES))
+    dummies = np.asarray(feature_values, dtype=np.float64)[positions][None, :]
+    for (categ, start, end, labels), (loc_max, max_values) in zip(groups, dummies_argmax(dummies, groups).values()):
+        values[categ] = float(max_values[0]) if loc_max is None else labels[loc_max[0]]
+    return values
+
+
+def shap_top_k(shap_names, shap_row, feature_values, columns, k=5):
+    """
+        The k lowest and the k highest shapley values of one customer with the values of their features (labels of the
+        bars of the dashboard)
+        :param shap_names: list of the names of the shapley values
+        :param shap_row: 1D array of the shapley values of the customer (SHAP_FEATURES and SHAP_CATEGORIES)
+        :param feature_values: 1D array of the features of the customer with dummies variables
+        :param columns: columns of feature_values
+        :param k: (int) number of shapley values on each side
+        :return: dict {"feature": [...], "shap_value": [...], "value": [...]} sorted by shapley value, at most 2 * k
+        """
+
+    order = np.argsort(shap_row, kind="stable")
+    if len(order) > 2 * k:
+        order = np.concatenate([order[:k], order[len(order) - k:]])
+    values = feature_values_for_api(feature_values, columns)
+    return {"feature": [shap_names[i] for i in order],
+            "shap_value": [float(shap_row[i]) for i in order],
+            "value": [values[shap_names[i]] for i in order]}
+
+
 # One hot encoding to a categorical variable
 def ohe_to_categ(data_dummies, categ):
     """
@@ -114,10 +253,7 @@ def ohe_to_categ(data_dummies, categ):
         :return: list which can be store in a df[column]
         """
 
-    df = data_dummies.filter(regex=categ)
-    df.columns = df.columns.str.replace(categ + '_', '')
-    df = df.idxmax(axis=1)
-    return list(df)
+    return list(categ_from_dummies(data_dummies, [categ])[categ])
 
 
 def data_for_api(df):
@@ -158,8 +294,9 @@ def data_for_api(df):
                  "ORGANIZATION_TYPE",
                  "OCCUPATION_TYPE"]
 
+    ohe_values = categ_from_dummies(df, ohe_categ)
     for categ in ohe_categ:
-        df_api[categ] = ohe_to_categ(df, categ)
+        df_api[categ] = ohe_values[categ]
 
     # Round
     feature_to_round = ["AMT_GOODS_PRICE",
@@ -183,3 +320,35 @@ def data_for_api(df):
     df_api.set_index("SK_ID_CURR", inplace=True)
 
     return df_api
+
+
+def score_records(list_record, pipeline, model_lgbm, explainer=None):
+    """
+        Score raw applications: preprocessing with transform_record() and one call to the model on a numpy array
+        :param list_record: list of dict {column: value} of raw applications
+        :param pipeline: dict of the fitted preprocessing
+        :param model_lgbm: model already loaded
+        :param explainer: explainer of the model (make_explainer()), if None the shapley values are not calculated
+        :return: list of dict {"SK_ID_CURR", "SCORING_PREDICT"} (and "shap_values") in the order of list_record
+        """
+
+    columns = pipeline["columns"]
+    X = np.array([transform_record(record, pipeline) for record in list_record], dtype=np.float64)
+    list_customer_id = [record.get("SK_ID_CURR") for record in list_record]
+    feature_positions = [i for i, col in enumerate(columns) if col != "SK_ID_CURR"]
+    feature_columns = [columns[i] for i in feature_positions]
+    X = X[:, feature_positions]
+
+    preds = ((1 - model_lgbm.predict_proba(X)[:, 1]) * 100).round()
+    results = [{"SK_ID_CURR": cust_id, "SCORING_PREDICT": float(pred)}
+               for cust_id, pred in zip(list_customer_id, preds)]
+
+    if explainer is not None:
+        shap_values = explainer.shap_values(X)[0]
+        feature_index = {col: i for i, col in enumerate(feature_columns)}
+        shap_select = {col: shap_values[:, feature_index[col]] for col in SHAP_FEATURES}
+        shap_select.update(shap_from_dummies(shap_values, feature_columns, SHAP_CATEGORIES))
+        for i, result in enumerate(results):
+            result["shap_values"] = {col: float(values[i]) for col, values in shap_select.items()}
+
+    return results
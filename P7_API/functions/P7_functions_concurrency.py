@@ -0,0 +1,246 @@
+# import
+import bisect
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+
+#############################################
+# BOUNDED EXECUTOR OF THE COMPUTATIONS
+class Overloaded(Exception):
+    """
+    Raised when the queue of the computations is full: the API answers 503 with a Retry-After header
+    """
+
+    def __init__(self, retry_after=1):
+        """
+        :param retry_after: (int) number of seconds before the client should try again
+        """
+        super().__init__("Too many computations in progress")
+        self.retry_after = retry_after
+
+
+class ComputeExecutor:
+    """
+    Pool of threads running the CPU-bound work of the routes (predict_proba, shapley values), shared by the threads of
+    a gthread worker. LightGBM and shap release the GIL, so the computations of several requests run on several cores.
+    The number of computations running or waiting is bounded: above, the request is refused at once (503) instead of
+    waiting behind the others.
+    """
+
+    def __init__(self, max_workers=None, max_pending=32, timeout=30, retry_after=1):
+        """
+        :param max_workers: (int) number of computations at the same time, None for the number of cores
+        :param max_pending: (int) number of computations waiting for a thread before the requests are refused
+        :param timeout: (float) maximum number of seconds a request waits for its computation
+        :param retry_after: (int) number of seconds sent in the Retry-After header of the 503 answers
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retry_after = retry_after
+        # The threads are only started at the first computation, so in the workers after the fork of gunicorn --preload
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._slots = threading.BoundedSemaphore(self.max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._counters = {"submitted": 0, "rejected": 0, "timeouts": 0, "in_progress": 0}
+
+    def _release(self, future):
+        """
+        Free the slot of a finished computation
+        :param future: finished future
+        :return: no return
+        """
+        self._slots.release()
+        with self._lock:
+            self._counters["in_progress"] -= 1
+
+    def run(self, func, *args, block=False, **kwargs):
+        """
+        Run a computation in the pool and wait for its result
+        :param func: function to run
+        :param args: positional arguments of func
+        :param block: (bool) if the queue is full, wait for a free slot (up to timeout) instead of refusing at once
+        :param kwargs: keyword arguments of func
+        :return: result of func (its exceptions are raised again)
+        """
+        if not (self._slots.acquire(timeout=self.timeout) if block else self._slots.acquire(blocking=False)):
+            with self._lock:
+                self._counters["rejected"] += 1
+            raise Overloaded(self.retry_after)
+        with self._lock:
+            self._counters["submitted"] += 1
+            self._counters["in_progress"] += 1
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except RuntimeError:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # The computation keeps its slot until it ends, the next requests are refused if the pool is saturated
+            with self._lock:
+                self._counters["timeouts"] += 1
+            raise Overloaded(self.retry_after)
+
+    def stats(self):
+        """
+        :return: dict of the counters of the executor
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats["max_workers"] = self.max_workers
+        stats["max_pending"] = self.max_pending
+        return stats
+
+
+#############################################
+# MICRO-BATCHING
+# Upper bounds of the buckets of the histograms (the last bucket counts everything above)
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+QUEUE_WAIT_MS_BUCKETS = [0.5, 1, 2, 5, 10, 20, 50, 100, 500]
+
+
+def histogram_add(counts, buckets, value):
+    """
+    Count a value in its bucket
+    :param counts: list of the counts, one more than the buckets
+    :param buckets: list of the upper bounds of the buckets (sorted)
+    :param value: (float) value to count
+    :return: no return
+    """
+    counts[bisect.bisect_left(buckets, value)] += 1
+
+
+def histogram_dict(counts, buckets):
+    """
+    :param counts: list of the counts, one more than the buckets
+    :param buckets: list of the upper bounds of the buckets
+    :return: dict {"<=bound": count, ..., ">last bound": count}
+    """
+    histogram = {"<=" + str(bound): count for bound, count in zip(buckets, counts)}
+    histogram[">" + str(buckets[-1])] = counts[-1]
+    return histogram
+
+
+class MicroBatcher:
+    """
+    Group the requests arriving at the same time: the first request of a batch waits window_ms milliseconds (or until
+    max_batch_size requests), then one function computes the whole batch (one call to predict_proba or to
+    shap_values instead of one per customer) and each request receives its own result.
+    """
+
+    def __init__(self, process_batch, window_ms=2, max_batch_size=64, max_pending=256, timeout=30, retry_after=1):
+        """
+        :param process_batch: function of a list of items returning the list of their results in the same order
+        :param window_ms: (float) number of milliseconds a batch waits for other requests after its first one
+        :param max_batch_size: (int) maximum number of items computed in one call
+        :param max_pending: (int) number of items waiting before the requests are refused (503)
+        :param timeout: (float) maximum number of seconds a request waits for its result
+        :param retry_after: (int) number of seconds sent in the Retry-After header of the 503 answers
+        """
+        self.process_batch = process_batch
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._counters = {"batches": 0, "items": 0, "rejected": 0, "timeouts": 0, "errors": 0}
+        self._batch_sizes = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self._queue_waits = [0] * (len(QUEUE_WAIT_MS_BUCKETS) + 1)
+
+    def _start(self):
+        """
+        Start the thread of the batches at the first request (in each worker, the threads are not copied by a fork)
+        :return: no return
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        """
+        Add an item to the next batch and wait for its result
+        :param item: item given to process_batch (customer id...)
+        :return: result of the item
+        """
+        self._start()
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self._counters["rejected"] += 1
+            raise Overloaded(self.retry_after)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self._counters["timeouts"] += 1
+            raise Overloaded(self.retry_after)
+
+    def _collect(self):
+        """
+        Wait for the first item of a batch, then for the other items during the window
+        :return: list of tuples (item, future, time of arrival)
+        """
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """
+        Loop of the thread of the batches
+        :return: no return
+        """
+        while True:
+            batch = self._collect()
+            start = time.perf_counter()
+            with self._lock:
+                self._counters["batches"] += 1
+                self._counters["items"] += len(batch)
+                histogram_add(self._batch_sizes, BATCH_SIZE_BUCKETS, len(batch))
+                for item, future, arrival in batch:
+                    histogram_add(self._queue_waits, QUEUE_WAIT_MS_BUCKETS, 1000 * (start - arrival))
+
+            try:
+                results = self.process_batch([item for item, future, arrival in batch])
+            except Exception as error:
+                with self._lock:
+                    self._counters["errors"] += 1
+                for item, future, arrival in batch:
+                    future.set_exception(error)
+                continue
+            for (item, future, arrival), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        """
+        :return: dict of the counters, of the histogram of the batch sizes and of the histogram of the waiting time (in
+        ms) of the items in the queue
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["batch_size_histogram"] = histogram_dict(self._batch_sizes, BATCH_SIZE_BUCKETS)
+            stats["queue_wait_ms_histogram"] = histogram_dict(self._queue_waits, QUEUE_WAIT_MS_BUCKETS)
+        stats["mean_batch_size"] = stats["items"] / stats["batches"] if stats["batches"] else None
+        stats["queue_size"] = self._queue.qsize()
+        return stats
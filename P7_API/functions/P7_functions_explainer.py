@@ -0,0 +1,44 @@
+# import
+# shap is imported only by make_explainer(backend="shap")
+
+
+#############################################
+# EXPLANATION OF THE SCORES
+# Explanation backends: the shapley values (TreeSHAP) are calculated by LightGBM itself ("native") or by the shap
+# package ("shap", imported only when it is used). Both give the same values. This module is the only copy: the API
+# imports it from its folder and P7_functions_ML.py from P7_API.functions.
+class NativeExplainer:
+    """
+    Shapley values calculated by LightGBM (predict with pred_contrib=True), with the output of shap.TreeExplainer:
+    list [shapley values of the class 0, shapley values of the class 1]
+    """
+
+    def __init__(self, model_lgbm):
+        """
+        :param model_lgbm: LightGBM classifier (binary)
+        """
+        self.model = model_lgbm
+
+    def shap_values(self, X):
+        """
+        :param X: dataframe or 2D array of the features
+        :return: list of two 2D arrays (rows, features), the shapley values of the class 0 and of the class 1
+        """
+        # The last column is the expected value
+        contributions = self.model.booster_.predict(X, pred_contrib=True)[:, :-1]
+        return [-contributions, contributions]
+
+
+def make_explainer(model_lgbm, backend="native"):
+    """
+    Build the explainer of a model
+    :param model_lgbm: LightGBM classifier (binary)
+    :param backend: (str) "native" (LightGBM pred_contrib) or "shap" (shap.TreeExplainer)
+    :return: explainer with a method shap_values(X)
+    """
+    if backend == "native":
+        return NativeExplainer(model_lgbm)
+    if backend == "shap":
+        import shap
+        return shap.TreeExplainer(model_lgbm)
+    raise ValueError("Unknown explanation backend: %s" % backend)
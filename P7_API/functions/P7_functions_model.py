@@ -0,0 +1,99 @@
+# import
+import threading
+import time
+
+import joblib
+
+from functions.P7_functions_explainer import make_explainer
+from functions.P7_functions_store import file_digest, file_signature
+
+
+#############################################
+# MODEL REGISTRY
+class LoadedModel:
+    """
+    A model loaded from a pickle file with its explainer
+    """
+
+    def __init__(self, path, explanation_backend="native"):
+        """
+        :param path: (str) path of the model (pickel file .pkl)
+        :param explanation_backend: (str) backend of the shapley values, "native" (LightGBM) or "shap"
+        """
+        self.path = path
+        self.signature = file_signature(path)
+        self.file_hash = file_digest(path)
+        self.model = joblib.load(path)
+        self.explainer = make_explainer(self.model, backend=explanation_backend)
+
+
+class ModelRegistry:
+    """
+    Load each model file once per process and share the model and its explainer between the routes.
+    A model is swapped for the new one when its file changes on disk.
+    With gunicorn --preload the models loaded at import are shared with the workers by copy-on-write.
+    """
+
+    def __init__(self, check_interval=5, explanation_backend="native"):
+        """
+        :param check_interval: (float) minimum number of seconds between two checks of a file on disk
+        :param explanation_backend: (str) backend of the shapley values, "native" (LightGBM) or "shap"
+        """
+        self.check_interval = check_interval
+        self.explanation_backend = explanation_backend
+        self._lock = threading.Lock()
+        self._models = {}
+        self._last_check = {}
+
+    def load(self, name_model_file):
+        """
+        Load (or reload) a model file and its explainer
+        :param name_model_file: (str) path of the model (pickel file .pkl)
+        :return: LoadedModel
+        """
+        loaded = LoadedModel(name_model_file, explanation_backend=self.explanation_backend)
+        # The dict entry is replaced in one step: a request uses either the old or the new model, never a mix
+        with self._lock:
+            self._models[name_model_file] = loaded
+            self._last_check[name_model_file] = time.monotonic()
+        return loaded
+
+    def get(self, name_model_file="data/model_lgbm.pkl"):
+        """
+        Return the loaded model, load it at first call and reload it if the file changed
+        :param name_model_file: (str) path of the model (pickel file .pkl)
+        :return: LoadedModel
+        """
+        loaded = self._models.get(name_model_file)
+        if loaded is None:
+            return self.load(name_model_file)
+
+        now = time.monotonic()
+        if now - self._last_check.get(name_model_file, 0) < self.check_interval:
+            return loaded
+        self._last_check[name_model_file] = now
+
+        try:
+            signature = file_signature(name_model_file)
+        except OSError:
+            return loaded
+        if signature == loaded.signature:
+            return loaded
+        if file_digest(name_model_file) == loaded.file_hash:
+            loaded.signature = signature
+            return loaded
+        return self.load(name_model_file)
+
+    def model(self, name_model_file="data/model_lgbm.pkl"):
+        """
+        :param name_model_file: (str) path of the model (pickel file .pkl)
+        :return: the machine learning model
+        """
+        return self.get(name_model_file).model
+
+    def explainer(self, name_model_file="data/model_lgbm.pkl"):
+        """
+        :param name_model_file: (str) path of the model (pickel file .pkl)
+        :return: the explainer of the model (shap_values(X))
+        """
+        return self.get(name_model_file).explainer
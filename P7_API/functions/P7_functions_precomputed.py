@@ -0,0 +1,95 @@
+# import
+import os
+import threading
+
+import joblib
+import numpy as np
+
+from functions.P7_functions_store import file_signature
+
+
+#############################################
+# PRECOMPUTED SCORES AND SHAPLEY VALUES
+class PrecomputedResults:
+    """
+    Scores and shapley values of the new customers calculated by P7_preprocessing.py.
+    The results are only used if they were calculated with the model and the data currently served.
+    """
+
+    def __init__(self, path="data/precomputed_results.pkl"):
+        """
+        :param path: (str) path of the pickle file exported by P7_preprocessing.py
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self.model_hash = None
+        self.data_hash = None
+        self.row_customer = {}
+        self.scores = np.array([])
+        self.shap_columns = []
+        self.shap_values = np.empty((0, 0))
+        self.load()
+
+    def load(self):
+        """
+        Load the pickle file if it exists
+        :return: no return
+        """
+        if not os.path.exists(self.path):
+            return
+        signature = file_signature(self.path)
+        results = joblib.load(self.path)
+        row_customer = {int(cust_id): row for row, cust_id in enumerate(results["SK_ID_CURR"])}
+
+        with self._lock:
+            self.model_hash = results["model_hash"]
+            self.data_hash = results["data_hash"]
+            self.row_customer = row_customer
+            self.scores = results["SCORING_PREDICT"]
+            self.shap_columns = results["shap_columns"]
+            self.shap_values = results["shap_values"]
+            self._signature = signature
+
+    def reload_if_changed(self):
+        """
+        Reload the pickle file if it changed on disk since the last load
+        :return: no return
+        """
+        try:
+            signature = file_signature(self.path)
+        except OSError:
+            return
+        if signature != self._signature:
+            self.load()
+
+    def is_valid(self, model_hash, data_hash):
+        """
+        :param model_hash: (str) hash of the model currently served
+        :param data_hash: (str) hash of the data currently served
+        :return: True if the results were calculated with this model and these data
+        """
+        return self.model_hash == model_hash and self.data_hash == data_hash
+
+    def scores_many(self, list_customer_id):
+        """
+        :param list_customer_id: list of SK_ID_CURR
+        :return: array of the scores in the order of list_customer_id, nan if not precomputed
+        """
+        with self._lock:
+            rows = np.array([self.row_customer.get(cust_id, -1) for cust_id in list_customer_id], dtype=np.int64)
+            scores = np.full(len(rows), np.nan)
+            found = rows >= 0
+            scores[found] = self.scores[rows[found]]
+        return scores
+
+    def shap(self, customer_id):
+        """
+        :param customer_id: (int) SK_ID_CURR of the customer
+        :return: dict {feature: shapley value} of the customer, None if not precomputed
+        """
+        with self._lock:
+            row = self.row_customer.get(customer_id)
+            if row is None:
+                return None
+            return dict(zip(self.shap_columns, self.shap_values[row].tolist()))
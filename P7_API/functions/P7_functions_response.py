@@ -0,0 +1,196 @@
+# import
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import orjson
+from flask import Response, request
+
+# numpy arrays and scalars are serialized directly, the keys of the dict can be int (customer ids)
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+#############################################
+# JSON RESPONSES
+def dumps(obj):
+    """
+    Serialize an object in json with orjson (nan are written null)
+    :param obj: dict, list, numpy array...
+    :return: (bytes) json
+    """
+    return orjson.dumps(obj, option=JSON_OPTIONS)
+
+
+def make_payload(obj):
+    """
+    Serialize an object once to send it several times
+    :param obj: dict, list, numpy array...
+    :return: tuple (json bytes, etag of the json)
+    """
+    body = dumps(obj)
+    return body, hashlib.sha1(body).hexdigest()
+
+
+def json_response(body, etag=None):
+    """
+    Response of json bytes. With an etag, the answer is 304 Not Modified if the client already has this json
+    (If-None-Match header).
+    :param body: (bytes) json
+    :param etag: (str) etag of the json, None for no etag
+    :return: flask Response
+    """
+    response = Response(body, mimetype="application/json")
+    if etag is not None:
+        response.set_etag(etag)
+        response = response.make_conditional(request)
+    return response
+
+
+class PayloadCache:
+    """
+    Bounded LRU cache of serialized responses (json bytes and etag). The keys contain the hashes of the model and of the
+    data, so a new model or new data never serve an old response.
+    With a path, the responses are also kept in a SQLite file shared by the gunicorn workers: a response built by a
+    worker is served by the others without computation.
+    """
+
+    def __init__(self, max_size=10000, path=None, max_disk_size=100000):
+        """
+        :param max_size: (int) maximum number of responses kept in memory
+        :param path: (str) path of the SQLite file shared by the workers, None for a cache in memory only
+        :param max_disk_size: (int) maximum number of responses kept in the SQLite file
+        """
+        self.max_size = max_size
+        self.path = path
+        self.max_disk_size = max_disk_size
+        self._lock = threading.Lock()
+        self._payloads = OrderedDict()
+        self._version = None
+        # One connection per thread, opened at its first use (after the fork of the workers)
+        self._local = threading.local()
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0,
+                          "invalidations": 0, "disk_errors": 0}
+
+    def _connection(self):
+        """
+        :return: SQLite connection of the current thread
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS payloads (key TEXT PRIMARY KEY, version TEXT, "
+                               "body BLOB, etag TEXT, created REAL)")
+            self._local.connection = connection
+        return connection
+
+    def _disk(self, func):
+        """
+        Run an operation on the SQLite file, the errors are counted and ignored (the cache is only an optimisation)
+        :param func: function of the connection
+        :return: result of func, None if error or no SQLite file
+        """
+        if self.path is None:
+            return None
+        try:
+            with self._connection() as connection:
+                return func(connection)
+        except sqlite3.Error:
+            with self._lock:
+                self._counters["disk_errors"] += 1
+            return None
+
+    def set_version(self, version):
+        """
+        Format of the responses, model and data currently served. When they change, the responses of the other versions
+        are removed from the memory and from the SQLite file.
+        :param version: tuple (format of the responses, hash of the model, hash of the data)
+        :return: no return
+        """
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            first = self._version is None
+            self._version = version
+            self._payloads.clear()
+            if not first:
+                self._counters["invalidations"] += 1
+        self._disk(lambda connection: connection.execute("DELETE FROM payloads WHERE version != ?",
+                                                         (str(version),)))
+
+    def get_or_build(self, key, build):
+        """
+        Return the serialized response of a key, built and cached at the first call
+        :param key: tuple (route, hashes..., customer id)
+        :param build: function without argument returning the object to serialize
+        :return: tuple (json bytes, etag)
+        """
+        with self._lock:
+            payload = self._payloads.get(key)
+            if payload is not None:
+                self._payloads.move_to_end(key)
+                self._counters["hits"] += 1
+                return payload
+
+        disk_key = "|".join(str(part) for part in key)
+        # Only the responses of the current version, even if a worker of the previous code still writes in the file
+        row = self._disk(lambda connection: connection.execute("SELECT body, etag FROM payloads "
+                                                               "WHERE key = ? AND version = ?",
+                                                               (disk_key, str(self._version))).fetchone())
+        if row is not None:
+            payload = (bytes(row[0]), row[1])
+            with self._lock:
+                self._counters["disk_hits"] += 1
+        else:
+            payload = make_payload(build())
+            with self._lock:
+                self._counters["misses"] += 1
+            self._disk(lambda connection: connection.execute("INSERT OR REPLACE INTO payloads VALUES (?, ?, ?, ?, ?)",
+                                                             (disk_key, str(self._version), payload[0], payload[1],
+                                                              time.time())))
+
+        with self._lock:
+            self._payloads[key] = payload
+            while len(self._payloads) > self.max_size:
+                self._payloads.popitem(last=False)
+                self._counters["evictions"] += 1
+            # The size of the SQLite file is checked every 100 new responses
+            check_disk = self.path is not None and self._counters["misses"] % 100 == 0 and row is None
+        if check_disk:
+            self._trim_disk()
+        return payload
+
+    def _trim_disk(self):
+        """
+        Remove the oldest responses of the SQLite file above max_disk_size
+        :return: no return
+        """
+        def trim(connection):
+            n_over = connection.execute("SELECT COUNT(*) FROM payloads").fetchone()[0] - self.max_disk_size
+            if n_over > 0:
+                connection.execute("DELETE FROM payloads WHERE key IN "
+                                   "(SELECT key FROM payloads ORDER BY created LIMIT ?)", (n_over,))
+            return max(n_over, 0)
+
+        n_removed = self._disk(trim)
+        if n_removed:
+            with self._lock:
+                self._counters["disk_evictions"] += n_removed
+
+    def stats(self):
+        """
+        :return: dict of the counters of the cache, its hit ratio and its sizes
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._payloads)
+        calls = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["disk_hits"]) / calls if calls else None
+        stats["disk_size"] = self._disk(lambda connection: connection.execute("SELECT COUNT(*) FROM payloads"
+                                                                              ).fetchone()[0])
+        return stats
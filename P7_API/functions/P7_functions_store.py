@@ -0,0 +1,344 @@
+# import
+import hashlib
+import json
+import os
+import threading
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+
+#############################################
+# FILES
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Calculate the sha256 hash of a file without loading it entirely in memory
+    :param path: (str) path of the file
+    :param chunk_size: (int) number of bytes read at each step
+    :return: (str) hexadecimal digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_signature(path):
+    """
+    Cheap signature of a file used to know if it changed on disk
+    :param path: (str) path of the file
+    :return: tuple (modification time in ns, size in bytes)
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Original order of the columns of a compact dataframe, kept in the metadata of the parquet and feather files
+# (compact_datas() and write_datas() of P7_preprocessing.py)
+COLUMNS_METADATA_KEY = b"columns_order"
+
+
+def table_to_pandas(table):
+    """
+    Convert a pyarrow table read from a parquet or feather file to a dataframe, with the original order of the columns
+    in df.attrs["columns"] if it is in the metadata of the file
+    :param table: pyarrow table
+    :return: dataframe
+    """
+    df = table.to_pandas()
+    metadata = table.schema.metadata or {}
+    if COLUMNS_METADATA_KEY in metadata:
+        df.attrs["columns"] = json.loads(metadata[COLUMNS_METADATA_KEY].decode())
+    return df
+
+
+def read_datas(path_file, columns=None, memory_map=True):
+    """
+    Read a data file: csv, or parquet and feather (binary, by columns, with the dtypes of the dataframe)
+    :param path_file: (str) path of the file, its format is given by its extension
+    :param columns: list of the columns to read, None for all the columns
+    :param memory_map: if True the parquet and feather files are read from a memory map of the file
+    :return: dataframe
+    """
+    extension = os.path.splitext(path_file)[1].lower()
+    if extension in (".parquet", ".pq"):
+        from pyarrow import parquet
+        return table_to_pandas(parquet.read_table(path_file, columns=columns, memory_map=memory_map,
+                                                  use_pandas_metadata=True))
+    if extension in (".feather", ".arrow"):
+        from pyarrow import feather
+        return table_to_pandas(feather.read_table(path_file, columns=columns, memory_map=memory_map))
+    return pd.read_csv(path_file, usecols=columns).drop(columns=["Unnamed: 0"], errors="ignore")
+
+
+def expand_dummies(df, columns=None):
+    """
+    Expand the categorical columns of a compact dataframe (compact_datas() of P7_preprocessing.py) to dummies columns,
+    in the original order of the columns
+    :param df: compact dataframe
+    :param columns: list of the columns in their original order, None for df.attrs["columns"] (the columns missing from
+    df are skipped, without it the dummies of a variable are put at the place of its categorical column)
+    :return: dataframe with the dummies columns (uint8) and the float columns in float64
+    """
+    list_columns = []
+    for col in df:
+        if pd.api.types.is_categorical_dtype(df[col]):
+            codes = df[col].cat.codes.to_numpy()
+            list_columns += [pd.Series((codes == i).astype(np.uint8), index=df.index, name=name)
+                             for i, name in enumerate(df[col].cat.categories)]
+        elif df[col].dtype == np.float32:
+            # Back to float64 before the rounding of data_for_api() (0.79 and not 0.7900000214576721)
+            list_columns.append(df[col].astype(np.float64))
+        else:
+            list_columns.append(df[col])
+    df_expanded = pd.concat(list_columns, axis=1)
+
+    if columns is None:
+        columns = df.attrs.get("columns")
+    if columns is not None:
+        df_expanded = df_expanded[[col for col in columns if col in df_expanded]]
+    return df_expanded
+
+
+#############################################
+# CUSTOMER STORE
+class CustomerStore:
+    """
+    Data of the new customers loaded once and indexed by SK_ID_CURR.
+    The file is reloaded when it changes on disk (modification time then hash check).
+    The data stay compact in memory (dummies packed in categorical columns), the rows returned are expanded.
+    """
+
+    def __init__(self, path="data/data_new_customer.parquet", check_interval=5):
+        """
+        :param path: (str) path of the data file of the new customers (parquet, feather or csv)
+        :param check_interval: (float) minimum number of seconds between two checks of the file on disk
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._last_check = 0
+        self._signature = None
+        self.file_hash = None
+        self.data = None
+        self.columns = None
+        self.index_list = np.array([], dtype=np.int64)
+        self.sorted_ids = np.array([], dtype=np.int64)
+        self.load()
+
+    def load(self):
+        """
+        Load the data file and build the index on SK_ID_CURR
+        :return: no return
+        """
+        signature = file_signature(self.path)
+        file_hash = file_digest(self.path)
+        data = read_datas(self.path)
+        data.index = pd.Index(data["SK_ID_CURR"], name=None)
+        # Build the hash table of the index now: pandas builds it lazily and not thread-safely at the first lookup
+        data.index.get_indexer(data.index[:1])
+        # Original order of the columns, the rows returned are expanded in this order
+        columns = data.attrs.get("columns")
+        index_list = data["SK_ID_CURR"].to_numpy(dtype=np.int64)
+        sorted_ids = np.sort(data["SK_ID_CURR"].to_numpy(dtype=np.int64))
+
+        # Swap every attribute at once so a request never sees half of a reload
+        with self._lock:
+            self.data = data
+            self.columns = columns
+            self.index_list = index_list
+            self.sorted_ids = sorted_ids
+            self.file_hash = file_hash
+            self._signature = signature
+            self._last_check = time.monotonic()
+
+    def reload_if_changed(self):
+        """
+        Reload the data file if it changed on disk since the last load
+        :return: True if the data has been reloaded
+        """
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+
+        try:
+            signature = file_signature(self.path)
+        except OSError:
+            return False
+        if signature == self._signature:
+            return False
+
+        # Modification time changed: only reload if the content is different
+        if file_digest(self.path) == self.file_hash:
+            self._signature = signature
+            return False
+        self.load()
+        return True
+
+    def __contains__(self, customer_id):
+        return customer_id in self.data.index
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, customer_id):
+        """
+        Return the data of a customer
+        :param customer_id: (int) SK_ID_CURR of the customer
+        :return: dataframe of one row, with the dummies columns
+        """
+        return expand_dummies(self.data.loc[[customer_id]], columns=self.columns)
+
+    def search(self, prefix=None, id_min=None, id_max=None, limit=20, offset=0):
+        """
+        Search customer ids in the sorted array of ids, without building the list of all the matches
+        :param prefix: (str) digits the ids start with, None for all the ids
+        :param id_min: (int) minimum id (included), None for no minimum
+        :param id_max: (int) maximum id (included), None for no maximum
+        :param limit: (int) maximum number of ids returned
+        :param offset: (int) number of matching ids skipped
+        :return: tuple (total number of matching ids, list of the ids of the page)
+        """
+        sorted_ids = self.sorted_ids
+        if len(sorted_ids) == 0:
+            return 0, []
+        low = -np.inf if id_min is None else id_min
+        high = np.inf if id_max is None else id_max + 1
+        if low >= high:
+            # id_min above id_max: no id
+            return 0, []
+
+        # Intervals [start, end[ of values matching the prefix, one per number of digits, in increasing order
+        if prefix is None:
+            intervals = [(low, high)]
+        else:
+            intervals = []
+            n_digits_max = len(str(int(sorted_ids[-1])))
+            for n_digits in range(len(prefix), n_digits_max + 1):
+                scale = 10 ** (n_digits - len(prefix))
+                start = max(int(prefix) * scale, 0 if n_digits == 1 else 10 ** (n_digits - 1), low)
+                end = min((int(prefix) + 1) * scale, 10 ** n_digits, high)
+                if start < end:
+                    intervals.append((start, end))
+
+        # Positions of the intervals in the sorted array of ids
+        ranges = [(np.searchsorted(sorted_ids, start, side="left"), np.searchsorted(sorted_ids, end, side="left"))
+                  for start, end in intervals]
+        total = int(sum(end - start for start, end in ranges))
+
+        page = []
+        for start, end in ranges:
+            skipped = min(offset, end - start)
+            offset -= skipped
+            start += skipped
+            take = min(limit - len(page), end - start)
+            page += [int(cust_id) for cust_id in sorted_ids[start:start + take]]
+            if len(page) >= limit:
+                break
+        return total, page
+
+    def get_many(self, list_customer_id):
+        """
+        Return the data of several customers, unknown ids are ignored
+        :param list_customer_id: list of SK_ID_CURR
+        :return: dataframe of the customers found with the dummies columns, in the order of list_customer_id
+        """
+        data = self.data
+        list_found = [cust_id for cust_id in list_customer_id if cust_id in data.index]
+        return expand_dummies(data.loc[list_found], columns=self.columns)
+
+
+#############################################
+# FEATURE MATRIX
+class FeatureMatrix:
+    """
+    Features of the new customers in a float32 matrix (exported by P7_preprocessing.py) read with a memory map:
+    the pages of the file are shared by all the workers, and the rows go to the model without a dataframe.
+    """
+
+    def __init__(self, path="data/features_new_customer.npy", path_index="data/features_new_customer_index.pkl"):
+        """
+        :param path: (str) path of the numpy file of the features
+        :param path_index: (str) path of the pickle file of the index (SK_ID_CURR of each row, columns, data hash)
+        """
+        self.path = path
+        self.path_index = path_index
+        self._lock = threading.Lock()
+        self._signature = None
+        self.features = None
+        self.columns = []
+        self.data_hash = None
+        self.sorted_ids = np.array([], dtype=np.int64)
+        self.sorted_rows = np.array([], dtype=np.int64)
+        self.load()
+
+    def load(self):
+        """
+        Map the numpy file in memory (read-only) and build the index id -> row, if the files exist
+        :return: no return
+        """
+        if not (os.path.exists(self.path) and os.path.exists(self.path_index)):
+            return
+        signature = (file_signature(self.path), file_signature(self.path_index))
+        features = np.load(self.path, mmap_mode="r")
+        index = joblib.load(self.path_index)
+        sorted_rows = np.argsort(index["SK_ID_CURR"], kind="stable")
+
+        with self._lock:
+            self.features = features
+            self.columns = index["columns"]
+            self.data_hash = index["data_hash"]
+            self.sorted_ids = index["SK_ID_CURR"][sorted_rows]
+            self.sorted_rows = sorted_rows
+            self._signature = signature
+
+    def reload_if_changed(self):
+        """
+        Reload the files if they changed on disk since the last load
+        :return: no return
+        """
+        try:
+            signature = (file_signature(self.path), file_signature(self.path_index))
+        except OSError:
+            return
+        if signature != self._signature:
+            self.load()
+
+    def is_valid(self, data_hash):
+        """
+        :param data_hash: (str) hash of the data of the new customers currently served
+        :return: True if the feature matrix was exported from these data
+        """
+        return self.features is not None and self.data_hash == data_hash
+
+    def rows(self, list_customer_id):
+        """
+        :param list_customer_id: list of SK_ID_CURR
+        :return: array of the rows of the customers in the matrix, -1 for the unknown ids
+        """
+        with self._lock:
+            sorted_ids, sorted_rows = self.sorted_ids, self.sorted_rows
+        list_customer_id = np.asarray(list_customer_id, dtype=np.int64)
+        if len(sorted_ids) == 0:
+            return np.full(len(list_customer_id), -1, dtype=np.int64)
+        positions = np.clip(np.searchsorted(sorted_ids, list_customer_id), 0, len(sorted_ids) - 1)
+        return np.where(sorted_ids[positions] == list_customer_id, sorted_rows[positions], -1)
+
+    def get(self, list_customer_id):
+        """
+        Features of customers, in the order of list_customer_id. One customer is a view on the memory map (no copy),
+        several customers a copy of their rows only.
+        :param list_customer_id: list of SK_ID_CURR, all in the matrix
+        :return: float32 array (customers, features)
+        """
+        rows = self.rows(list_customer_id)
+        if (rows < 0).any():
+            raise KeyError([cust_id for cust_id, row in zip(list_customer_id, rows) if row < 0])
+        features = self.features
+        if len(rows) == 1:
+            return features[rows[0]:rows[0] + 1]
+        return features[rows]
@@ -0,0 +1,116 @@
+# import
+import math
+
+import numpy as np
+import pandas as pd
+
+
+#############################################
+# PREPROCESSING OF NEW APPLICATIONS
+# The same steps as encoding(), aligning() and feature_engineering() of P7_functions_preprocessing.py, with the dict of
+# the fitted preprocessing (fit_preprocessing(), exported in data/preprocessing_pipeline.pkl). This module is the only
+# copy: the API imports it from its folder and P7_functions_preprocessing.py from P7_API.functions.
+POLY_FEATURES = ['EXT_SOURCE_1', 'EXT_SOURCE_2', 'EXT_SOURCE_3', 'DAYS_BIRTH']
+DOMAIN_FEATURES = [('CREDIT_INCOME_PERCENT', 'AMT_CREDIT', 'AMT_INCOME_TOTAL'),
+                   ('ANNUITY_INCOME_PERCENT', 'AMT_ANNUITY', 'AMT_INCOME_TOTAL'),
+                   ('CREDIT_TERM', 'AMT_CREDIT', 'AMT_ANNUITY'),
+                   ('DAYS_EMPLOYED_PERCENT', 'DAYS_EMPLOYED', 'DAYS_BIRTH')]
+
+
+def ratio(a, b):
+    """
+    Division of two floats with the result of pandas for a division by 0 (inf or nan)
+    :param a: (float) numerator
+    :param b: (float) denominator
+    :return: (float) a / b
+    """
+    if b == 0:
+        return np.nan if a == 0 or math.isnan(a) else math.copysign(np.inf, a)
+    return a / b
+
+
+def transform_record(record, pipeline):
+    """
+    Preprocess one raw application without pandas (for the API, well under 1 ms)
+    :param record: dict {column: value} of a raw application, missing columns and None are missing values
+    :param pipeline: dict returned by fit_preprocessing()
+    :return: list of the values of the columns pipeline["columns"]
+    """
+
+    values = dict(pipeline["fill_values"])
+
+    # Encoding
+    for col in pipeline["numeric_columns"]:
+        value = record.get(col)
+        values[col] = np.nan if value is None else float(value)
+    for col, classes in pipeline["label_encoders"].items():
+        value = record.get(col)
+        values[col] = classes.index(value) if value in classes else np.nan
+    for col, categories in pipeline["dummies"].items():
+        value = record.get(col)
+        for category in categories:
+            values[col + "_" + str(category)] = int(value == category)
+
+    # Feature engineering
+    days_employed = values['DAYS_EMPLOYED']
+    values['DAYS_EMPLOYED_ANOM'] = days_employed == 365243
+    values['DAYS_EMPLOYED'] = np.nan if days_employed == 365243 else abs(days_employed)
+    values['DAYS_BIRTH'] = abs(values['DAYS_BIRTH'])
+
+    poly_values = [pipeline["medians"][col] if math.isnan(values[col]) else values[col] for col in POLY_FEATURES]
+    for name, powers in zip(pipeline["poly_names"], pipeline["poly_powers"]):
+        if name not in values:
+            product = 1.0
+            for value, power in zip(poly_values, powers):
+                if power:
+                    product *= value ** power
+            values[name] = product
+
+    for name, numerator, denominator in DOMAIN_FEATURES:
+        values[name] = ratio(values[numerator], values[denominator])
+
+    return [values[col] for col in pipeline["columns"]]
+
+
+def transform_frame(df, pipeline):
+    """
+    Preprocess a dataframe of raw applications with a fitted preprocessing
+    :param df: dataframe of raw applications
+    :param pipeline: dict returned by fit_preprocessing()
+    :return: dataframe of the columns pipeline["columns"] (and TARGET if it is in df)
+    """
+
+    data = {}
+
+    # Encoding
+    for col in pipeline["numeric_columns"]:
+        data[col] = df[col] if col in df else pd.Series(np.nan, index=df.index)
+    for col, classes in pipeline["label_encoders"].items():
+        encoded = df[col].map({label: code for code, label in enumerate(classes)})
+        data[col] = encoded if encoded.isna().any() else encoded.astype(np.int64)
+    for col, categories in pipeline["dummies"].items():
+        for category in categories:
+            data[col + "_" + str(category)] = (df[col] == category).astype(np.uint8)
+
+    # Feature engineering
+    data['DAYS_EMPLOYED_ANOM'] = data["DAYS_EMPLOYED"] == 365243
+    data['DAYS_EMPLOYED'] = abs(data['DAYS_EMPLOYED'].replace({365243: np.nan}))
+    data['DAYS_BIRTH'] = abs(data['DAYS_BIRTH'])
+
+    poly_values = pd.DataFrame({col: data[col] for col in POLY_FEATURES}).fillna(pipeline["medians"]).to_numpy()
+    poly_powers = np.array(pipeline["poly_powers"])
+    poly_features = np.prod(poly_values[:, np.newaxis, :] ** poly_powers[np.newaxis, :, :], axis=2)
+    for i, name in enumerate(pipeline["poly_names"]):
+        if name not in data:
+            data[name] = poly_features[:, i]
+
+    for name, numerator, denominator in DOMAIN_FEATURES:
+        data[name] = data[numerator] / data[denominator]
+
+    for col, value in pipeline["fill_values"].items():
+        data[col] = value
+
+    df_transformed = pd.DataFrame(data, index=df.index)[pipeline["columns"]]
+    if "TARGET" in df and pipeline["target_position"] is not None:
+        df_transformed.insert(pipeline["target_position"], "TARGET", df["TARGET"])
+    return df_transformed
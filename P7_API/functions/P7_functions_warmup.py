@@ -0,0 +1,170 @@
+# import
+import os
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no gunicorn, the file is only written by one process
+    fcntl = None
+
+
+#############################################
+# ACCESS LOG
+class AccessLog:
+    """
+    Customer ids requested to the API, appended to a text file (one id per line) by buffers. The file is kept by the
+    next start of the API to warm up the cache with the most requested customers.
+    The file is shared by the gunicorn workers: the writes and the rotation of the file are done under a lock on the
+    file path + ".lock", so two workers never rotate the file at the same time (the second one would overwrite ".old").
+    """
+
+    def __init__(self, path="data/access_log.txt", flush_size=100, flush_interval=60, max_bytes=5000000):
+        """
+        :param path: (str) path of the text file, None to log nothing
+        :param flush_size: (int) number of ids kept in memory before they are written
+        :param flush_interval: (float) maximum number of seconds an id is kept in memory
+        :param max_bytes: (int) size of the file above which it is renamed path + ".old" and a new file is started
+        """
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def record(self, customer_id):
+        """
+        Log a request of a customer
+        :param customer_id: (int) SK_ID_CURR of the customer
+        :return: no return
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            self._buffer.append(customer_id)
+            if len(self._buffer) < self.flush_size and time.monotonic() - self._last_flush < self.flush_interval:
+                return
+        self.flush()
+
+    @contextmanager
+    def _file_lock(self, shared=False):
+        """
+        Lock between the processes on the file path + ".lock"
+        :param shared: (bool) True for a lock shared by the readers, False for an exclusive lock
+        :return: context manager
+        """
+        with open(self.path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            # The lock is released when the file is closed
+            yield
+
+    def flush(self):
+        """
+        Append the ids in memory to the file
+        :return: no return
+        """
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+            if not buffer:
+                return
+            try:
+                with self._file_lock():
+                    if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                        os.replace(self.path, self.path + ".old")
+                    with open(self.path, "a") as file:
+                        file.write("".join(str(cust_id) + "\n" for cust_id in buffer))
+            except OSError:
+                pass
+
+    def top(self, n, max_lines=1000000):
+        """
+        Most requested customers of the file (and of the previous file)
+        :param n: (int) number of customers
+        :param max_lines: (int) number of last lines read
+        :return: list of the n most requested SK_ID_CURR
+        """
+        if self.path is None:
+            return []
+        lines = deque(maxlen=max_lines)
+        try:
+            with self._file_lock(shared=True):
+                for path in [self.path + ".old", self.path]:
+                    try:
+                        with open(path) as file:
+                            lines.extend(line.strip() for line in file)
+                    except OSError:
+                        continue
+        except OSError:
+            return []
+        counts = Counter(int(line) for line in lines if line.isascii() and line.isdigit())
+        return [cust_id for cust_id, count in counts.most_common(n)]
+
+
+#############################################
+# WARM-UP
+class WarmUp:
+    """
+    Warm-up of a worker run once in a background thread: the steps are run in order, then the worker is ready.
+    A step that fails is reported in the stats and does not block the readiness.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self.step_durations = {}
+        self.errors = {}
+
+    def start(self, steps):
+        """
+        Start the warm-up if it is not started yet (in the worker, after the fork of gunicorn --preload)
+        :param steps: list of tuples (name of the step, function without argument)
+        :return: no return
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(steps,), daemon=True)
+            self._thread.start()
+
+    def _run(self, steps):
+        """
+        Run the steps of the warm-up
+        :param steps: list of tuples (name of the step, function without argument)
+        :return: no return
+        """
+        for name, func in steps:
+            start = time.perf_counter()
+            try:
+                func()
+            except Exception:
+                self.errors[name] = traceback.format_exc(limit=3)
+            self.step_durations[name] = time.perf_counter() - start
+        self._ready.set()
+
+    def is_started(self):
+        """
+        :return: True if the warm-up was started
+        """
+        return self._thread is not None
+
+    def is_ready(self):
+        """
+        :return: True if the warm-up is finished
+        """
+        return self._ready.is_set()
+
+    def stats(self):
+        """
+        :return: dict of the state of the warm-up, the duration of each step (in s) and the errors
+        """
+        return {"started": self.is_started(), "ready": self.is_ready(),
+                "step_durations": dict(self.step_durations), "errors": dict(self.errors)}
@@ -0,0 +1,18 @@
+# Configuration of gunicorn (Procfile)
+# Threaded workers: a slow computation does not block the other requests of the worker
+worker_class = "gthread"
+workers = 2
+threads = 8
+# The application (data, model) is loaded once in the master and shared with the workers by copy-on-write
+preload_app = True
+
+
+def post_worker_init(worker):
+    """
+    Start the warm-up of the worker after the fork (first predictions, shapley values and caches): LightGBM is only run
+    in the workers, never in the master
+    :param worker: gunicorn worker
+    :return: no return
+    """
+    import P7_API
+    P7_API.start_warm_up()
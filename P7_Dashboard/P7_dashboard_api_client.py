@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+########################################################################
+# CLIENT OF THE API
+class ApiClient:
+    """
+    Client of the API of the project: one pooled requests.Session (keep-alive, no new TLS handshake per call),
+    a bounded LRU cache with time to live keyed by route and customer id, concurrent downloads and counters.
+    When an answer of the cache is too old, it is checked with its etag: the API answers 304 if it did not change.
+    """
+
+    def __init__(self, api_url, timeout=10, cache_size=256, cache_ttl=300, pool_size=10, max_workers=4):
+        """
+        :param api_url: (str) main url of the API
+        :param timeout: (float) timeout in seconds of a call to the API
+        :param cache_size: (int) maximum number of answers kept in the cache
+        :param cache_ttl: (float) number of seconds an answer is kept in the cache
+        :param pool_size: (int) number of connections kept open to the API
+        :param max_workers: (int) number of downloads at the same time
+        """
+        self.api_url = api_url
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504]))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._latencies = deque(maxlen=1000)
+        self._counters = {"hits": 0, "misses": 0, "not_modified": 0, "errors": 0, "evictions": 0}
+
+    def url(self, api_route, customer_id=None):
+        """
+        :param api_route: (str) route to the data
+        :param customer_id: (int) customer_id
+        :return: (str) url of the data, with the final "/" of the routes of the API to avoid a redirection
+        """
+        if customer_id is None:
+            return self.api_url + api_route
+        return self.api_url + api_route + str(customer_id) + "/"
+
+    def get_json(self, api_route, customer_id=None, params=None):
+        """
+        Download json data from the API, or take it from the cache
+        :param api_route: (str) route to the data
+        :param customer_id: (int) customer_id
+        :param params: dict of the parameters of the query string
+        :return: json data (list or dict)
+        """
+        key = (api_route, customer_id, tuple(sorted(params.items())) if params else None)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > now:
+                self._cache.move_to_end(key)
+                self._counters["hits"] += 1
+                return cached[1]
+            self._counters["misses"] += 1
+
+        headers = {}
+        if cached is not None and cached[2] is not None:
+            headers["If-None-Match"] = cached[2]
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.url(api_route, customer_id), params=params, headers=headers,
+                                        timeout=self.timeout)
+            response.raise_for_status()
+            if response.status_code == 304:
+                data_json = cached[1]
+            else:
+                data_json = response.json()
+        except (requests.RequestException, ValueError):
+            with self._lock:
+                self._counters["errors"] += 1
+            raise
+        latency = time.perf_counter() - start
+
+        with self._lock:
+            self._latencies.append(latency)
+            if response.status_code == 304:
+                self._counters["not_modified"] += 1
+            self._cache[key] = (time.monotonic() + self.cache_ttl, data_json, response.headers.get("ETag"))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self._counters["evictions"] += 1
+        return data_json
+
+    def get_many(self, list_route_id):
+        """
+        Download several json data at the same time
+        :param list_route_id: list of tuples (api_route, customer_id) or (api_route, customer_id, params)
+        :return: list of json data in the order of list_route_id
+        """
+        futures = [self.executor.submit(self.get_json, *route_id) for route_id in list_route_id]
+        return [future.result() for future in futures]
+
+    def stats(self):
+        """
+        :return: dict of the counters of the cache and of the latency (in ms) of the calls to the API
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            latencies = sorted(self._latencies)
+            stats["cache_size"] = len(self._cache)
+        calls = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / calls if calls else None
+        stats["latency_ms"] = {"count": len(latencies),
+                               "mean": 1000 * sum(latencies) / len(latencies) if latencies else None,
+                               "p50": 1000 * latencies[len(latencies) // 2] if latencies else None,
+                               "p95": 1000 * latencies[int(len(latencies) * 0.95)] if latencies else None,
+                               "max": 1000 * latencies[-1] if latencies else None}
+        return stats
@@ -1,17 +1,20 @@
 import requests
-import json
 import pandas as pd
-import random
+import numpy as np
+import os
 
 # Dash
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 
 # Plotly
 import plotly.graph_objects as go
-import plotly.express as px
+
+# Client of the API
+from P7_dashboard_api_client import ApiClient
 
 # Tuto
 # https://dash.plotly.com/basic-callbacks
@@ -19,24 +22,16 @@ import plotly.express as px
 ########################################################################
 url_heroku = "https://p7-oc-api.herokuapp.com"
 
+# Pooled and cached connection to the API
+api_client = ApiClient(url_heroku)
+
 
-# Import data from API
-def import_api(api_url=url_heroku,
-               api_route="/api/new_customer/",
-               customer_id=None):
+def json_to_data(data_json):
     """
-    Import data from an API
-    :param api_url: (str) main url of the API
-    :param api_route: (str) route to the data
-    :param customer_id: (int) customer_id
-    :return: dataframe of the data downloaded from the API
+    Convert json data of the API
+    :param data_json: json data downloaded from the API
+    :return: list, or dataframe indexed by customer id
     """
-    if customer_id is None:
-        url = api_url + api_route
-    else:
-        url = api_url + api_route + str(customer_id)
-    data_json = requests.get(url).json()
-
     if type(data_json) is list:
         data = data_json.copy()
     else:
@@ -46,12 +41,6 @@ def import_api(api_url=url_heroku,
     return data
 
 
-comparison_data = pd.read_csv("comparison_data.csv").drop(columns=["Unnamed: 0"])
-
-
-# print(comparison_data["DAYS_BIRTH_qcut"].unique())
-
-
 ########################################################################
 # REUSABLE COMPONENTS
 def generate_table(df, max_rows=10):
@@ -73,32 +62,159 @@ def generate_table(df, max_rows=10):
     ])
 
 
-# list of dict of SK_ID_CURR
-list_index = import_api(api_url=url_heroku,
-                        api_route="/api/new_customer/index_list/")
-list_dict_id = [{"label": str(cust_id), "value": int(cust_id)} for cust_id in list_index]
+# Customer id selected at the opening of the dashboard. The other ids are searched in the API while typing
+default_customer_id = 100001
+search_limit = 50
+# Number of shapley values lowering and raising the score shown in the graph (top_k of the API)
+shap_top_k = 5
 
 
 # Calculate statistics for comparison
-def filter_comparison(df, filter="ALL", list_var=None):
+def prepare_comparison(df, list_var=None):
+    """
+    Split the comparison data in arrays of summaries, one per combination of intervals, to merge them quickly
+    :param df: dataframe comparison data (calculated by calc_comparison_data)
+    :param list_var: list of the variables names
+    :return: dict of the combinations and of the arrays of their summaries
+    """
+    if not (df["AGG"] == "count").any():
+        # Comparison data calculated before the summaries: statistics already aggregated by combination
+        return {"legacy": df}
+    list_value = [col for col in df.columns if col not in ["AGG"] + list_var]
+
+    list_agg = list(df["AGG"].drop_duplicates())
+    n_agg = len(list_agg)
+    summaries = df[list_value].to_numpy(dtype=np.float64).reshape(-1, n_agg, len(list_value))
+    list_quantile = [i for i, name_agg in enumerate(list_agg) if name_agg.startswith("quantile_")]
+
+    comparison = {"columns": list_value,
+                  "combinations": df[list_var].iloc[::n_agg].reset_index(drop=True),
+                  "count": summaries[:, list_agg.index("count"), :],
+                  "sum": summaries[:, list_agg.index("sum"), :],
+                  "min": summaries[:, list_agg.index("min"), :],
+                  "max": summaries[:, list_agg.index("max"), :],
+                  "quantiles": summaries[:, list_quantile, :],
+                  "levels": np.array([int(list_agg[i][len("quantile_"):]) / 100 for i in list_quantile])}
+    return comparison
+
+
+def sketch_cdf(points, levels, x, side="right"):
+    """
+    Cumulative distribution function of each combination, linear between the points of its summary
+    :param points: array (combinations, points) of the min, the quantiles and the max of the combinations
+    :param levels: array (points) of the levels of the points (0, quantiles, 1)
+    :param x: sorted array of values
+    :param side: "right" for P(X <= x), "left" for P(X < x)
+    :return: array (combinations, values)
+    """
+    n_points = len(levels)
+    # Number of points of each combination lower than (or equal to) each value
+    if side == "right":
+        k = (points[:, :, None] <= x[None, None, :]).sum(axis=1)
+    else:
+        k = (points[:, :, None] < x[None, None, :]).sum(axis=1)
+    k_in = np.clip(k, 1, n_points - 1)
+    x0 = np.take_along_axis(points, k_in - 1, axis=1)
+    x1 = np.take_along_axis(points, k_in, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.where(x1 > x0, (x - x0) / (x1 - x0), 1.0)
+    value = levels[k_in - 1] + fraction * (levels[k_in] - levels[k_in - 1])
+    return np.where(k == 0, 0.0, np.where(k >= n_points, 1.0, value))
+
+
+def quantile_from_sketches(count, points, levels, quantiles):
+    """
+    Quantiles of a variable on a union of combinations: quantiles of the mixture of the distributions of the
+    combinations weighted by their count. Approximation: the distribution of each combination is linear between the
+    points of its summary, the rank error is at most the largest gap between two consecutive levels (0.25 with the
+    quantiles 0.1, 0.25, 0.5, 0.75, 0.9), about 2 to 5% measured on the data of the former customers
+    :param count: array (combinations) of the number of values of the variable
+    :param points: array (combinations, points) of the min, the quantiles and the max of the variable
+    :param levels: array (points) of the levels of the points (0, quantiles, 1)
+    :param quantiles: list of the quantiles to calculate (floats between 0 and 1)
+    :return: array of the quantiles, nan if there is no value
+    """
+    kept = count > 0
+    if not kept.any():
+        return np.full(len(quantiles), np.nan)
+    weights = count[kept] / count[kept].sum()
+    points = points[kept]
+    x = np.unique(points)
+    cdf_right = weights @ sketch_cdf(points, levels, x, side="right")
+    cdf_left = weights @ sketch_cdf(points, levels, x, side="left")
+
+    values = []
+    for q in quantiles:
+        i = min(np.searchsorted(cdf_right, q, side="left"), len(x) - 1)
+        if i > 0 and cdf_left[i] >= q > cdf_right[i - 1]:
+            # q is reached on the linear part between the values i - 1 and i
+            fraction = (q - cdf_right[i - 1]) / (cdf_left[i] - cdf_right[i - 1])
+            values.append(x[i - 1] + fraction * (x[i] - x[i - 1]))
+        else:
+            values.append(x[i])
+    return np.array(values)
+
+
+def filter_comparison(comparison, filter="ALL", list_var=None):
     """
-    filter comparison data
-    :param df: dataframe comparison data
+    filter comparison data: merge the summaries of the combinations of intervals selected
+    :param comparison: dict of the comparison data (returned by prepare_comparison)
     :param filter: list of the intervals filter
     :param list_var: list of the variables names
-    :return: dataframe of the comparison data filtered
+    :return: dataframe of the comparison data filtered, indexed by
+    ["mean", "min", "q10", "q25", "median", "q75", "q90", "max"]
     """
-    df_filter = df.copy()
+    if "legacy" in comparison:
+        df_filter = comparison["legacy"]
+        if filter != "ALL":
+            for var_i in range(len(list_var)):
+                df_filter = df_filter[df_filter[list_var[var_i]].isin(filter[var_i])]
+        # Approximation without a bound: the statistics (mean and quantiles) of the combinations are averaged without
+        # their count, which is not in this comparison data. Calculate the comparison data again to get the summaries
+        return df_filter.groupby(["AGG"]).mean(numeric_only=True)
+
+    selection = np.ones(len(comparison["combinations"]), dtype=bool)
     if filter != "ALL":
         for var_i in range(len(list_var)):
             name_var = list_var[var_i]
             intervals = filter[var_i]
-            df_filter = df_filter[df_filter[name_var].isin(intervals)]
-    df_filter_agg = df_filter.groupby(["AGG"]).mean()
+            selection &= comparison["combinations"][name_var].isin(intervals).to_numpy()
+
+    count = comparison["count"][selection]
+    v_min = comparison["min"][selection]
+    v_max = comparison["max"][selection]
+    # Points of the distribution of each combination: min, quantiles, max
+    points = np.concatenate([v_min[:, None, :], comparison["quantiles"][selection], v_max[:, None, :]], axis=1)
+    levels = np.concatenate([[0], comparison["levels"], [1]])
+    list_q = [0.1, 0.25, 0.5, 0.75, 0.9]
+    quantiles = np.array([quantile_from_sketches(count[:, j], points[:, :, j], levels, list_q)
+                          for j in range(count.shape[1])]).reshape(-1, len(list_q)).T
+
+    total = count.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = comparison["sum"][selection].sum(axis=0) / total
+    # fmin / fmax skip the missing values
+    v_min = np.fmin.reduce(v_min, axis=0, initial=np.inf)
+    v_max = np.fmax.reduce(v_max, axis=0, initial=-np.inf)
+    empty = total == 0
+    v_min[empty] = np.nan
+    v_max[empty] = np.nan
+
+    df_filter_agg = pd.DataFrame([mean, v_min, *quantiles, v_max],
+                                 index=["mean", "min", "q10", "q25", "median", "q75", "q90", "max"],
+                                 columns=comparison["columns"])
     return df_filter_agg
 
 
 list_var = ["AMT_CREDIT_qcut", "ANNUITY_INCOME_PERCENT_qcut", "DAYS_BIRTH_qcut"]
+# Only the columns displayed in the dashboard are read
+comparison_columns = ["AGG"] + list_var + ["SCORING_PREDICT", "ANNUITY_INCOME_PERCENT", "DAYS_EMPLOYED_PERCENT",
+                                           "AMT_ANNUITY", "AMT_GOODS_PRICE"]
+if os.path.exists("comparison_data.parquet"):
+    df_comparison = pd.read_parquet("comparison_data.parquet", columns=comparison_columns, memory_map=True)
+else:
+    df_comparison = pd.read_csv("comparison_data.csv", usecols=lambda col: col in comparison_columns)
+comparison_data = prepare_comparison(df_comparison, list_var=list_var)
 data_comparison_agg = filter_comparison(comparison_data, filter="ALL", list_var=list_var)
 
 
@@ -162,6 +278,11 @@ app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 
 server = app.server
 
+
+@server.route("/api_client/stats/")
+def get_api_client_stats():
+    return api_client.stats()
+
 # colors = {
 #     'background': 'white',
 #     'text': 'black'
@@ -193,11 +314,13 @@ app.layout = html.Div(children=[
              style={'textAlign': 'center'}
              ),
     dcc.Dropdown(id='customer_id-dropdown',
-                 options=list_dict_id,
-                 value=100001,
+                 options=[{"label": str(default_customer_id), "value": default_customer_id}],
+                 value=default_customer_id,
                  placeholder="Select a customer id",
                  style={"width": "50%", "margin": "auto"}
                  ),
+    # Data and shapley values of the selected customer, downloaded once and shared by the graphs
+    dcc.Store(id='customer-store'),
 
     html.H3(children="Informations générales du client et son score",
             style={'textAlign': 'center'}),
@@ -306,14 +429,65 @@ app.layout = html.Div(children=[
 ])
 
 
+def store_to_dataframe(customer_data, key):
+    """
+    Dataframe of the data of the customer stored in customer-store
+    :param customer_data: data of customer-store
+    :param key: (str) "data" for the data of the customer
+    :return: dataframe of one row indexed by the customer id
+    """
+    if customer_data is None:
+        raise PreventUpdate
+    return pd.DataFrame.from_dict({customer_data["customer_id"]: customer_data[key]}, orient="index")
+
+
 @app.callback(
-    Output('table_description', 'figure'),
+    Output('customer_id-dropdown', 'options'),
+    Input('customer_id-dropdown', 'search_value'),
+    State('customer_id-dropdown', 'value')
+)
+def update_customer_id_options(search_value, customer_id):
+    if not search_value:
+        raise PreventUpdate
+    list_id = []
+    prefix = search_value.strip()
+    # Same check as the API: only ASCII digits ("²".isdigit() is True)
+    if prefix.isascii() and prefix.isdigit():
+        try:
+            list_id = api_client.get_json("/api/new_customer/search/",
+                                          params={"q": prefix, "limit": search_limit})["customer_ids"]
+        except (requests.RequestException, ValueError, KeyError):
+            # API unavailable or error: no suggestion, the dashboard keeps working
+            list_id = []
+    # The selected customer stays in the options, otherwise the dropdown would clear it
+    if customer_id is not None and customer_id not in list_id:
+        list_id = [customer_id] + list_id
+    return [{"label": str(cust_id), "value": cust_id} for cust_id in list_id]
+
+
+@app.callback(
+    Output('customer-store', 'data'),
     Input('customer_id-dropdown', 'value')
 )
-def update_table_description_id(customer_id):
-    data_new_customer_id = import_api(api_url=url_heroku,
-                                      api_route="/api/new_customer/",
-                                      customer_id=customer_id)
+def update_customer_store(customer_id):
+    if customer_id is None:
+        raise PreventUpdate
+    # Both routes at the same time, only the shapley values shown in the graph
+    data_json, shap_json = api_client.get_many([("/api/new_customer/", customer_id),
+                                                ("/api/new_customer/shap_values/", customer_id,
+                                                 {"top_k": shap_top_k})])
+    return {"customer_id": customer_id,
+            "data": json_to_data(data_json).loc[customer_id].to_dict(),
+            "shap": shap_json[str(customer_id)]}
+
+
+@app.callback(
+    Output('table_description', 'figure'),
+    Input('customer-store', 'data')
+)
+def update_table_description_id(customer_data):
+    data_new_customer_id = store_to_dataframe(customer_data, "data")
+    customer_id = customer_data["customer_id"]
 
     data_new_customer_id_table = data_new_customer_id[["CODE_GENDER",
                                                        "DAYS_BIRTH",
@@ -347,15 +521,14 @@ def update_table_description_id(customer_id):
 
 @app.callback(
     Output('scoring-gauge', 'figure'),
-    Input('customer_id-dropdown', 'value'),
+    Input('customer-store', 'data'),
     Input('amt_credit-checklist', 'value'),
     Input('annuity_income_percent-checklist', 'value'),
     Input('days_birth-checklist', 'value')
 )
-def update_scoring_gauge(customer_id, credit_range, annuity_income_range, days_birth_range):
-    data_new_customer_id = import_api(api_url=url_heroku,
-                                      api_route="/api/new_customer/",
-                                      customer_id=customer_id)
+def update_scoring_gauge(customer_data, credit_range, annuity_income_range, days_birth_range):
+    data_new_customer_id = store_to_dataframe(customer_data, "data")
+    customer_id = customer_data["customer_id"]
 
     score_id = data_new_customer_id.loc[customer_id, "SCORING_PREDICT"]
 
@@ -389,15 +562,14 @@ def update_scoring_gauge(customer_id, credit_range, annuity_income_range, days_b
 
 @app.callback(
     Output('indicator-gauge', 'figure'),
-    Input('customer_id-dropdown', 'value'),
+    Input('customer-store', 'data'),
     Input('amt_credit-checklist', 'value'),
     Input('annuity_income_percent-checklist', 'value'),
     Input('days_birth-checklist', 'value')
 )
-def update_indicator_gauge(customer_id, credit_range, annuity_income_range, days_birth_range):
-    data_new_customer_id = import_api(api_url=url_heroku,
-                                      api_route="/api/new_customer/",
-                                      customer_id=customer_id)
+def update_indicator_gauge(customer_data, credit_range, annuity_income_range, days_birth_range):
+    data_new_customer_id = store_to_dataframe(customer_data, "data")
+    customer_id = customer_data["customer_id"]
 
     list_filter = [credit_range, annuity_income_range, days_birth_range]
     data_comparison_agg_up = filter_comparison(comparison_data, filter=list_filter, list_var=list_var)
@@ -424,28 +596,22 @@ def update_indicator_gauge(customer_id, credit_range, annuity_income_range, days
 
 @app.callback(
     Output('shap-force-plot', 'figure'),
-    Input('customer_id-dropdown', 'value')
+    Input('customer-store', 'data')
 )
-def update_shap_force_plot(customer_id):
-    data_new_customer_id = import_api(api_url=url_heroku,
-                                      api_route="/api/new_customer/",
-                                      customer_id=customer_id)
-    app_new_customer_shap = data_new_customer_id.drop(columns=["SCORING_PREDICT"])
-
-    data_shap_values = import_api(api_url=url_heroku,
-                                  api_route="/api/new_customer/shap_values/",
-                                  customer_id=customer_id)
-    shap_sorted = data_shap_values.loc[customer_id, :].sort_values()
-    n_features = 5
-    shap_sorted_min = shap_sorted[:n_features]
-    shap_sorted_max = shap_sorted[-n_features:]
+def update_shap_force_plot(customer_data):
+    if customer_data is None:
+        raise PreventUpdate
+    # Shapley values sorted by the API with the values of their features
+    shap_sorted = customer_data["shap"]
+    shap_sorted_min = {key: values[:shap_top_k] for key, values in shap_sorted.items()}
+    shap_sorted_max = {key: values[-shap_top_k:] for key, values in shap_sorted.items()}
 
     fig = go.Figure()
 
     fig.add_trace(go.Bar(
-        x=shap_sorted_min.values,
-        y=shap_sorted_min.index,
-        text=app_new_customer_shap.loc[customer_id, shap_sorted_min.index].values,
+        x=shap_sorted_min["shap_value"],
+        y=shap_sorted_min["feature"],
+        text=shap_sorted_min["value"],
         textposition="inside",
         name='Valeurs diminuant le score',
         orientation='h',
@@ -454,9 +620,9 @@ def update_shap_force_plot(customer_id):
     ))
 
     fig.add_trace(go.Bar(
-        x=shap_sorted_max.values,
-        y=shap_sorted_max.index,
-        text=app_new_customer_shap.loc[customer_id, shap_sorted_max.index].values,
+        x=shap_sorted_max["shap_value"],
+        y=shap_sorted_max["feature"],
+        text=shap_sorted_max["value"],
         textposition="inside",
         name='Valeurs augmentant le score',
         orientation='h',
@@ -1,24 +1,29 @@
 # import
 import numpy as np
 import pandas as pd
-# Modeling
-import lightgbm as lgb
-import shap
+# Modeling (lightgbm is imported when the model is unpickled, shap only by make_explainer(backend="shap"))
 import joblib
 
+from P7_functions.P7_functions_preprocessing import file_digest, parallel_apply
+from P7_functions.P7_functions_data_for_API import shap_from_dummies
+# Explanation of the scores, shared with the API
+from P7_API.functions.P7_functions_explainer import make_explainer
+
 
 #########################################
 # MACHINE LEARNING
 
-def lgbm_scoring_prediction(df, name_model_file="model_lgbm.pkl"):
+def lgbm_scoring_prediction(df, name_model_file="model_lgbm.pkl", model_lgbm=None):
     """
     Apply the model name_model_file to a dataframe and return the same dataframe with the prediction in %
     :param df: Dataframe
     :param name_model_file: name of the model (pickel file .pkl)
+    :param model_lgbm: model already loaded, if None the model is loaded from name_model_file
     :return: dataframe df with the prediction of the model
     """
 
-    model_lgbm = joblib.load(name_model_file)
+    if model_lgbm is None:
+        model_lgbm = joblib.load(name_model_file)
 
     # Prepared datas
     try:
@@ -47,22 +52,19 @@ def shap_to_categ(data_dummies, categ):
     :return: a list of shapley values than can be store in df[column]
     """
 
-    df = data_dummies.filter(regex=categ)
-    df_abs = df.abs()
-    max_loc = df_abs.idxmax(axis="columns")
-    max_shap = [df.loc[id_cust, max_loc[id_cust]] for id_cust in df.index]
-    return max_shap
+    return list(shap_from_dummies(data_dummies.to_numpy(), data_dummies.columns, [categ])[categ])
+
 
-def shapley_values(df, name_model_file="model_lgbm.pkl"):
+def shapley_values(df, name_model_file="model_lgbm.pkl", explainer=None, backend="native"):
     """
     Calculate shapley values of a dataframe for a model
     :param df: dataframe
     :param name_model_file: str of the name of the machine learning model (pickel file .pkl)
+    :param explainer: explainer already built (make_explainer()), if None it is built from name_model_file
+    :param backend: (str) backend of the explainer built if explainer is None, "native" or "shap"
     :return: dataframe of the shapley values
     """
 
-    model_lgbm = joblib.load(name_model_file)
-
     # Prepared datas
     X = df.set_index("SK_ID_CURR")
     try:
@@ -70,7 +72,9 @@ def shapley_values(df, name_model_file="model_lgbm.pkl"):
     except KeyError:
         pass
 
-    explainer = shap.TreeExplainer(model_lgbm)
+    if explainer is None:
+        model_lgbm = joblib.load(name_model_file)
+        explainer = make_explainer(model_lgbm, backend=backend)
     shap_values = explainer.shap_values(X)
     shap_values_df = pd.DataFrame(shap_values[0], index=X.index, columns=X.columns)
 
@@ -96,7 +100,66 @@ def shapley_values(df, name_model_file="model_lgbm.pkl"):
 
     shap_values_df_select = shap_values_df[feature_selection]
 
+    shap_categ = shap_from_dummies(shap_values[0], X.columns, categories)
     for categ in categories:
-        shap_values_df_select[categ] = shap_to_categ(shap_values_df, categ)
+        shap_values_df_select[categ] = shap_categ[categ]
+
+    return shap_values_df_select
+
+
+# Scores and shapley values of a whole population
+def scores_shap(df, name_model_file="model_lgbm.pkl", batch_size=10000, backend="native"):
+    """
+    Calculate the score and the shapley values of the customers of a dataframe, by batches of rows
+    :param df: dataframe of the customers (with SK_ID_CURR)
+    :param name_model_file: str of the name of the machine learning model (pickel file .pkl)
+    :param batch_size: (int) number of customers scored at once
+    :param backend: (str) backend of the shapley values, "native" or "shap"
+    :return: dataframe of the shapley values and of the score (column SCORING_PREDICT) indexed by SK_ID_CURR
+    """
+
+    model_lgbm = joblib.load(name_model_file)
+    explainer = make_explainer(model_lgbm, backend=backend)
+
+    list_results = []
+    for i in range(0, len(df), batch_size):
+        df_batch = df.iloc[i:i + batch_size]
+        df_results = shapley_values(df_batch, explainer=explainer)
+        df_results["SCORING_PREDICT"] = lgbm_scoring_prediction(df_batch, model_lgbm=model_lgbm
+                                                                )["SCORING_PREDICT"].to_numpy()
+        list_results.append(df_results)
+
+    return pd.concat(list_results)
+
+
+def precompute_scores_shap(df, name_model_file="model_lgbm.pkl", name_data_file=None, batch_size=10000, n_jobs=1,
+                           backend="native"):
+    """
+    Calculate the score and the shapley values of all the customers of a dataframe, by batches of rows,
+    to be served by the API without computation
+    :param df: dataframe of the customers (with SK_ID_CURR)
+    :param name_model_file: str of the name of the machine learning model (pickel file .pkl)
+    :param name_data_file: str of the data file served by the API, its hash tags the results
+    :param batch_size: (int) number of customers scored at once
+    :param n_jobs: (int) number of processes (see parallel_apply())
+    :param backend: (str) backend of the shapley values, "native" or "shap"
+    :return: dict of columnar arrays in the order of SK_ID_CURR and the hashes of the model and of the data
+    """
+
+    # Features in float32 like in the feature matrix read by the API (export_feature_matrix()): the precomputed results
+    # are the ones the API calculates for the same customers
+    X = df.drop(columns=["SK_ID_CURR", "TARGET"], errors="ignore").astype(np.float32)
+    df = pd.concat([df[["SK_ID_CURR"]], X], axis=1)
+
+    df_results = parallel_apply(scores_shap, df, n_jobs=n_jobs, name_model_file=name_model_file,
+                                batch_size=batch_size, backend=backend)
+    df_shap = df_results.drop(columns=["SCORING_PREDICT"])
+
+    results = {"model_hash": file_digest(name_model_file),
+               "data_hash": None if name_data_file is None else file_digest(name_data_file),
+               "SK_ID_CURR": df["SK_ID_CURR"].to_numpy(),
+               "SCORING_PREDICT": df_results["SCORING_PREDICT"].to_numpy(),
+               "shap_columns": list(df_shap.columns),
+               "shap_values": df_shap.to_numpy()}
 
-    return shap_values_df_select
\ No newline at end of file
+    return results
@@ -1,86 +1,74 @@
 import numpy as np
 import pandas as pd
-import itertools
 
 
 # Calculate statistics
-# def Percentile
-def q10(x):
-    """
-    Return values at the given quantile 0.1 on x
-    :param x: dataframe requested axis
-    :return: quantile 0.1
-    """
-    return x.quantile(0.1)
-
-
-def q25(x):
-    """
-        Return values at the given quantile 0.25 on x
-        :param x: dataframe requested axis
-        :return: quantile 0.25
-        """
-    return x.quantile(0.25)
-
-
-def q75(x):
-    """
-        Return values at the given quantile 0.75 on x
-        :param x: dataframe requested axis
-        :return: quantile 0.75
-        """
-    return x.quantile(0.75)
-
-
-def q90(x):
-    """
-        Return values at the given quantile 0.9 on x
-        :param x: dataframe requested axis
-        :return: quantile 0.9
-        """
-    return x.quantile(0.9)
+# Compact summaries of each combination of bins: count, sum, min, max and a few quantiles of each variable. The summary
+# of any union of combinations is calculated from the summaries of the combinations: exact count, sum (mean), min and
+# max. The quantiles are approximated: they are those of the mixture of the distributions of the combinations, each one
+# linear between its min, quantiles and max. This is not a sketch with a guaranteed accuracy (t-digest, KLL): the rank
+# error is only bounded by the largest gap between two consecutive levels (0.25 with SKETCH_QUANTILES), about 2 to 5%
+# measured on application_train.csv for the filters of the dashboard.
+SUMMARY_STATISTICS = ["count", "sum", "min", "max"]
+SKETCH_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
 
 
-def calc_comparison_data(df, list_var=[]):
+def calc_comparison_data(df, list_var=[], n_bins=5, quantiles=SKETCH_QUANTILES):
     """
     Return the dataframe that will be used in the dashboard as comparison data.
-    Cut the variables in 5 with quantile(0.2, 0.4, 0.6, 0.8). Then for all possible combinations and
-    for each variable selected the function calculated ["mean", "min", q10, q25, "median", q75, q90, "max"]
+    Cut the variables in n_bins with quantiles (0.2, 0.4, 0.6, 0.8 for 5 bins). Then for all the combinations of bins
+    containing customers and for each variable selected the function calculated a mergeable summary:
+    count, sum, min, max and the quantiles of the values ("quantile_010" row for the quantile 0.1...).
+    The mean, min and max of a union of combinations are exact, its quantiles are approximated (see SKETCH_QUANTILES).
     :param df: original dataframe
     :param list_var: list of variables selected
+    :param n_bins: (int or list of int, one per variable) number of bins of each variable
+    :param quantiles: list of the quantiles kept in the summaries
     :return: The dataframe used in the final dashboard as comparison data.
     """
 
     df_t0 = df[df["TARGET"] == 0]
     # Select only numeric
     df_t0 = df_t0.select_dtypes(exclude=['object'])
+    list_value = list(df_t0.columns)
 
-    # Select var for the filter
-    list_list_value = []
-
-    for var in list_var:
-        df_t0[var + "_qcut"] = pd.qcut(df_t0[var], 5)
-        list_list_value.append(list(df_t0[var + "_qcut"].dropna().unique()))
-
-    list_combination = list(itertools.product(*list_list_value))
+    if isinstance(n_bins, int):
+        n_bins = [n_bins] * len(list_var)
 
-    # CREATE DATAFRAME OF THE AGG
-    df_t0_agg = pd.DataFrame(columns=df_t0.columns)
-
-    for combination in list_combination:
-        df_combination = df_t0.copy()
-        # filter
-        for i in range(len(list_var)):
-            df_combination = df_combination[df_combination[list_var[i] + "_qcut"] == combination[i]]
-        # AGG
-        df_combination_agg = df_combination.agg(["mean", "min", q10, q25, "median", q75, q90, "max"])
-
-        # Fill combination value
-        for i in range(len(list_var)):
-            df_combination_agg[list_var[i] + "_qcut"] = combination[i]
-        df_t0_agg = df_t0_agg.append(df_combination_agg)
-
-    df_t0_agg.reset_index(inplace=True)
-    df_t0_agg.rename(columns={"index": "AGG"}, inplace=True)
+    # Select var for the filter
+    list_qcut = [var + "_qcut" for var in list_var]
+    list_intervals = []
+    list_codes = []
+    for var, n_bins_var in zip(list_var, n_bins):
+        var_cut = pd.qcut(df_t0[var], n_bins_var)
+        list_codes.append(var_cut.cat.codes.to_numpy())
+        # Intervals as strings ("(44999.999, 254700.0]"), the values of the checklists of the dashboard: the parquet
+        # files do not store Interval objects
+        list_intervals.append(np.asarray(var_cut.cat.categories.astype(str)))
+    codes = np.column_stack(list_codes)
+
+    # Customers with a missing value in a filter variable are in no combination
+    in_combination = (codes >= 0).all(axis=1)
+    combinations, combination_id = np.unique(codes[in_combination], axis=0, return_inverse=True)
+    combination_id = combination_id.ravel()
+    n_combinations = len(combinations)
+    values = df_t0[list_value].to_numpy(dtype=np.float64)[in_combination]
+
+    # Summaries
+    grouped = pd.DataFrame(values).groupby(combination_id)
+    summaries = np.stack([grouped.count().to_numpy(dtype=np.float64),
+                          grouped.sum().to_numpy(),
+                          grouped.min().to_numpy(),
+                          grouped.max().to_numpy()] +
+                         [grouped.quantile(q).to_numpy() for q in quantiles], axis=1)
+
+    # One block of rows per combination
+    list_agg = SUMMARY_STATISTICS + ["quantile_%03d" % round(100 * q) for q in quantiles]
+    df_t0_agg = pd.DataFrame(summaries.reshape(-1, len(list_value)), columns=list_value)
+    df_t0_agg.insert(0, "AGG", np.tile(list_agg, n_combinations))
+
+    # Fill combination value
+    for i, var_qcut in enumerate(list_qcut):
+        df_t0_agg[var_qcut] = np.repeat(list_intervals[i][combinations[:, i]], len(list_agg))
 
     return df_t0_agg
@@ -1,10 +1,84 @@
 # import
 import numpy as np
-import pandas as pd
+# Utils
+import re
+from functools import lru_cache
 
 
 #############################################
 # FOR API
+# Index of the dummies columns of the categorical variables
+@lru_cache(maxsize=32)
+def categ_column_groups(columns, categories):
+    """
+    Index the dummies columns of each categorical variable, calculated once for a layout of columns
+    :param columns: tuple of the columns of the dataframe with dummies variables
+    :param categories: tuple of the names of the variables with dummies
+    :return: array of the positions of the dummies columns grouped by variable and
+    list of tuples (name of the variable, start and end of its group in the positions, array of its categories)
+    """
+
+    positions = []
+    groups = []
+    for categ in categories:
+        start = len(positions)
+        columns_categ = [(i, col) for i, col in enumerate(columns) if re.search(categ, col)]
+        positions += [i for i, col in columns_categ]
+        labels = np.array([col.replace(categ + '_', '') for i, col in columns_categ], dtype=object)
+        groups.append((categ, start, len(positions), labels))
+    return np.array(positions, dtype=np.int64), tuple(groups)
+
+
+def dummies_argmax(values, groups, absolute=False):
+    """
+    Position and value of the maximum of each group of dummies columns, for all the rows at once
+    :param values: 2D array, the columns are the dummies columns in the order of categ_column_groups
+    :param groups: groups returned by categ_column_groups
+    :param absolute: if True the maximum is calculated on the absolute values
+    :return: dict {name of the variable: (array of the position of the max in the group, array of the max)}
+    """
+
+    results = {}
+    for categ, start, end, labels in groups:
+        if start == end:
+            results[categ] = (None, np.full(len(values), np.nan))
+            continue
+        values_categ = values[:, start:end]
+        loc_max = (np.abs(values_categ) if absolute else values_categ).argmax(axis=1)
+        results[categ] = (loc_max, np.take_along_axis(values_categ, loc_max[:, None], axis=1)[:, 0])
+    return results
+
+
+def categ_from_dummies(data_dummies, categories):
+    """
+    Create the categorical variables from their dummies variables
+    :param data_dummies: dataframe with variables in one hot encoding
+    :param categories: list of the names of the variables
+    :return: dict {name of the variable: array of the categories which can be store in a df[column]}
+    """
+
+    positions, groups = categ_column_groups(tuple(data_dummies.columns), tuple(categories))
+    values = data_dummies.iloc[:, positions].to_numpy(dtype=np.float64)
+    results = {}
+    for (categ, start, end, labels), (loc_max, max_values) in zip(groups, dummies_argmax(values, groups).values()):
+        results[categ] = max_values if loc_max is None else labels[loc_max]
+    return results
+
+
+def shap_from_dummies(shap_values, columns, categories):
+    """
+    Maximum shapley values (in absolute value) of the dummies variables of several categorical variables
+    :param shap_values: 2D array of the shapley values with dummies variables
+    :param columns: columns of shap_values
+    :param categories: list of the names of the variables with dummies
+    :return: dict {name of the variable: array of shapley values which can be store in a df[column]}
+    """
+
+    positions, groups = categ_column_groups(tuple(columns), tuple(categories))
+    results = dummies_argmax(shap_values[:, positions], groups, absolute=True)
+    return {categ: max_values for categ, (loc_max, max_values) in results.items()}
+
+
 # One hot encoding to a categorical variable
 def ohe_to_categ(data_dummies, categ):
     """
@@ -14,10 +88,7 @@ def ohe_to_categ(data_dummies, categ):
     :return: list which can be store in a df[column]
     """
 
-    df = data_dummies.filter(regex=categ)
-    df.columns = df.columns.str.replace(categ + '_', '')
-    df = df.idxmax(axis=1)
-    return list(df)
+    return list(categ_from_dummies(data_dummies, [categ])[categ])
 
 
 def data_for_api(df):
@@ -58,8 +129,9 @@ def data_for_api(df):
                  "ORGANIZATION_TYPE",
                  "OCCUPATION_TYPE"]
 
+    ohe_values = categ_from_dummies(df, ohe_categ)
     for categ in ohe_categ:
-        df_api[categ] = ohe_to_categ(df, categ)
+        df_api[categ] = ohe_values[categ]
 
     # Round
     feature_to_round = ["AMT_GOODS_PRICE",
@@ -1,15 +1,20 @@
 # import
 import numpy as np
 import pandas as pd
-# sklearn preprocessing for dealing with categorical variables
-from sklearn.preprocessing import LabelEncoder
-# imputer for handling missing values
-from sklearn.impute import SimpleImputer
-# Polynomial features
-from sklearn.preprocessing import PolynomialFeatures
+# sklearn (LabelEncoder, SimpleImputer, PolynomialFeatures) and pyarrow are imported by the functions using them:
+# the modules only importing a few functions of this file (file_digest, parallel_apply...) do not load them
 # File system management
 import pathlib
-import random
+import hashlib
+import joblib
+import json
+import os
+# Parallel processing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+# Preprocessing of new applications with the fitted pipeline (transform_frame() for a dataframe), the same code as the
+# API (transform_record() for one application is imported from P7_API.functions.P7_functions_transform)
+from P7_API.functions.P7_functions_transform import POLY_FEATURES, DOMAIN_FEATURES, transform_frame
 
 
 # functions for the API
@@ -21,20 +26,119 @@ import random
 # 4 - feature_engineering()
 
 
-def load_data(name_file=None, name_file_directory="P7_data", name_python_file="P7_preprocessing.py"):
+# Formats of the data files: csv, or parquet and feather (binary, by columns, with the dtypes of the dataframe)
+def file_format_of(name_file, file_format=None):
+    """
+    Format of a data file
+    :param name_file: (str) name of the file
+    :param file_format: (str) "csv", "parquet" or "feather", if None the format is given by the extension of the file
+    :return: (str) "csv", "parquet" or "feather"
+    """
+    if file_format is not None:
+        return file_format
+    extension = pathlib.Path(name_file).suffix.lower()
+    if extension in (".parquet", ".pq"):
+        return "parquet"
+    if extension in (".feather", ".arrow"):
+        return "feather"
+    return "csv"
+
+
+# Original order of the columns of a compact dataframe (df.attrs["columns"], see compact_datas()), kept in the metadata
+# of the parquet and feather files
+COLUMNS_METADATA_KEY = b"columns_order"
+
+
+def table_to_pandas(table):
+    """
+    Convert a pyarrow table read from a parquet or feather file to a dataframe, with the original order of the columns
+    in df.attrs["columns"] if it is in the metadata of the file
+    :param table: pyarrow table
+    :return: dataframe
+    """
+    df = table.to_pandas()
+    metadata = table.schema.metadata or {}
+    if COLUMNS_METADATA_KEY in metadata:
+        df.attrs["columns"] = json.loads(metadata[COLUMNS_METADATA_KEY].decode())
+    return df
+
+
+def read_datas(path_file, columns=None, file_format=None, memory_map=True, chunksize=None):
+    """
+    Read a data file
+    :param path_file: (str) path of the file
+    :param columns: list of the columns to read, None for all the columns
+    :param file_format: (str) "csv", "parquet" or "feather", if None the format is given by the extension of the file
+    :param memory_map: if True the parquet and feather files are read from a memory map of the file
+    :param chunksize: (int) if not None, number of rows of each chunk (only for csv files)
+    :return: dataframe, or iterator of dataframes of chunksize rows if chunksize is not None
+    """
+    file_format = file_format_of(path_file, file_format)
+    if file_format == "csv":
+        return pd.read_csv(path_file, usecols=columns, chunksize=chunksize)
+    if chunksize is not None:
+        raise ValueError("chunksize is only available for csv files")
+    if file_format == "parquet":
+        from pyarrow import parquet
+        return table_to_pandas(parquet.read_table(path_file, columns=columns, memory_map=memory_map,
+                                                  use_pandas_metadata=True))
+    if file_format == "feather":
+        from pyarrow import feather
+        return table_to_pandas(feather.read_table(path_file, columns=columns, memory_map=memory_map))
+    raise ValueError("Unknown file format: " + str(file_format))
+
+
+def write_datas(df, path_file, file_format=None, append=False):
+    """
+    Write a dataframe in a data file
+    :param df: dataframe to write
+    :param path_file: (str) path of the file
+    :param file_format: (str) "csv", "parquet" or "feather", if None the format is given by the extension of the file
+    :param append: if True the rows are added at the end of the file, without header (only for csv files)
+    :return: no return
+    """
+    file_format = file_format_of(path_file, file_format)
+    if file_format == "csv":
+        df.to_csv(path_file, mode="a" if append else "w", header=not append)
+        return
+    if append:
+        raise ValueError("append is only available for csv files")
+    if file_format not in ("parquet", "feather"):
+        raise ValueError("Unknown file format: " + str(file_format))
+    import pyarrow
+    from pyarrow import feather, parquet
+    # The index is not written: no more "Unnamed: 0" column when the file is read
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    if "columns" in df.attrs:
+        metadata = dict(table.schema.metadata or {})
+        metadata[COLUMNS_METADATA_KEY] = json.dumps(list(df.attrs["columns"])).encode()
+        table = table.replace_schema_metadata(metadata)
+    if file_format == "parquet":
+        parquet.write_table(table, path_file)
+    else:
+        feather.write_feather(table, path_file)
+
+
+def load_data(name_file=None, name_file_directory="P7_data", name_python_file="P7_preprocessing.py", chunksize=None,
+              columns=None, file_format=None, memory_map=True):
     """
     load data from an other folder
-    :param name_file: (str) name of the csv file
-    :param name_file_directory: (str) name of the directory where the csv file is
+    :param name_file: (str) name of the data file (csv, parquet or feather)
+    :param name_file_directory: (str) name of the directory where the data file is
     :param name_python_file: (str) name of the current python file
-    :return: dataframe of the csv file
+    :param chunksize: (int) if not None, number of rows of each chunk (only for csv files)
+    :param columns: list of the columns to read, None for all the columns
+    :param file_format: (str) "csv", "parquet" or "feather", if None the format is given by the extension of the file
+    :param memory_map: if True the parquet and feather files are read from a memory map of the file
+    :return: dataframe of the data file, or iterator of dataframes of chunksize rows if chunksize is not None
     """
 
     # Get datas directory path
     path = str(pathlib.Path(name_python_file).parent.resolve())
     path_datas = path + "\\" + name_file_directory
     # get datas
-    datas = pd.read_csv(path_datas + "\\" + name_file)
+    datas = read_datas(path_datas + "\\" + name_file, columns=columns, file_format=file_format,
+                       memory_map=memory_map, chunksize=chunksize)
     return datas
 
 
@@ -46,6 +150,7 @@ def encoding(df):
     """
 
     # Create a label encoder object
+    from sklearn.preprocessing import LabelEncoder
     le = LabelEncoder()
 
     # Iterate through the columns
@@ -110,12 +215,14 @@ def feature_engineering(df):
         poly_features = df[['EXT_SOURCE_1', 'EXT_SOURCE_2', 'EXT_SOURCE_3', 'DAYS_BIRTH']]
 
     # imputer for handling missing values
+    from sklearn.impute import SimpleImputer
     imputer = SimpleImputer(strategy='median')
 
     # Need to impute missing values
     poly_features = imputer.fit_transform(poly_features)
 
     # Create the polynomial object with specified degree
+    from sklearn.preprocessing import PolynomialFeatures
     poly_transformer = PolynomialFeatures(degree=3)
 
     # Train the polynomial features
@@ -160,24 +267,314 @@ def feature_engineering(df):
     return df_poly_domain
 
 
-def export_datas(df, name_python_file="P7_preprocessing.py", name_file_out=None, path_folder_out=None):
+# Fitted preprocessing pipeline
+# The same steps as encoding(), aligning() and feature_engineering(), fitted once and stored in a dict of lists and
+# numbers (pickle file exported with export_artifact()). The API transforms new applications with this dict without
+# fitting anything again.
+# POLY_FEATURES, DOMAIN_FEATURES, transform_record() and transform_frame() are in P7_API/functions (shared with the API)
+ALIGNING_DROP = ['CODE_GENDER_XNA', 'NAME_FAMILY_STATUS_Unknown', 'NAME_INCOME_TYPE_Maternity leave']
+# Maximum number of rows kept to calculate the medians of the polynomial features (32 MB): the medians are exact up to
+# this number of rows (307 511 rows in application_train.csv), calculated on a uniform random sample above
+MEDIAN_SAMPLE_SIZE = 1000000
+
+
+def reservoir_update(sample, n_seen, values, rng, sample_size=MEDIAN_SAMPLE_SIZE):
+    """
+    Add the rows of a chunk to a uniform random sample of all the rows seen, of bounded size (reservoir sampling).
+    The sample keeps every row while less than sample_size rows are seen.
+    :param sample: array (rows, columns) of the sample, None before the first chunk
+    :param n_seen: (int) number of rows seen before the chunk
+    :param values: array (rows, columns) of the chunk
+    :param rng: numpy random generator
+    :param sample_size: (int) maximum number of rows of the sample
+    :return: tuple (sample, number of rows seen)
+    """
+    n_free = max(sample_size - n_seen, 0)
+    sample = values[:n_free].copy() if sample is None else np.concatenate([sample, values[:n_free]])
+    rest = values[n_free:]
+    if len(rest):
+        # The row number i (over all the rows) replaces a random row of the sample with probability
+        # sample_size / (i + 1)
+        positions = rng.integers(0, n_seen + n_free + np.arange(len(rest)) + 1)
+        replaced = positions < sample_size
+        # A position drawn several times in the chunk keeps the last row (first one of the reversed rows)
+        positions, rows = positions[replaced][::-1], rest[replaced][::-1]
+        positions, first = np.unique(positions, return_index=True)
+        sample[positions] = rows[first]
+    return sample, n_seen + len(values)
+
+
+def fit_preprocessing(df, columns=None):
+    """
+    Fit the preprocessing on raw applications (application_train.csv or application_test.csv)
+    :param df: dataframe of raw applications, or iterator of dataframes (chunks of load_data() with chunksize)
+    :param columns: list of the columns of the preprocessed data expected by the model, if None the columns are the ones
+    created by encoding(), aligning() and feature_engineering() on df
+    :return: dict of the fitted preprocessing, used by transform_record() and transform_frame()
+    """
+
+    if isinstance(df, pd.DataFrame):
+        df = [df]
+
+    # Categories of the object columns and sample of the features of the polynomial features, chunk by chunk
+    object_columns = None
+    categories = {}
+    missing = {}
+    poly_sample, n_rows = None, 0
+    rng = np.random.default_rng(0)
+    for df_chunk in df:
+        if object_columns is None:
+            object_columns = [col for col in df_chunk if df_chunk[col].dtype == 'object']
+            all_columns = list(df_chunk.columns)
+            categories = {col: set() for col in object_columns}
+            missing = {col: False for col in object_columns}
+        for col in object_columns:
+            categories[col].update(df_chunk[col].dropna().unique())
+            missing[col] = missing[col] or bool(df_chunk[col].isna().any())
+        poly_values = df_chunk[POLY_FEATURES].to_numpy(dtype=np.float64)
+        poly_sample, n_rows = reservoir_update(poly_sample, n_rows, poly_values, rng)
+
+    # Encoding
+    label_encoders = {}
+    dummies = {}
+    for col in object_columns:
+        # Same count of unique values as encoding() (missing values included)
+        if len(categories[col]) + missing[col] <= 2 and col != "CODE_GENDER":
+            label_encoders[col] = sorted(categories[col])
+        else:
+            dummies[col] = sorted(categories[col])
+    numeric_columns = [col for col in all_columns if col not in object_columns and col != "TARGET"]
+
+    # Imputer on the features of the polynomial features
+    medians = pd.DataFrame(poly_sample, columns=POLY_FEATURES)
+    medians['DAYS_BIRTH'] = abs(medians['DAYS_BIRTH'])
+    medians = medians.median()
+
+    # Polynomial features
+    from sklearn.preprocessing import PolynomialFeatures
+    poly_transformer = PolynomialFeatures(degree=3)
+    poly_transformer.fit(medians.to_numpy().reshape(1, -1))
+    poly_names = poly_transformer.get_feature_names(POLY_FEATURES)
+
+    # Columns created by the preprocessing, in the same order as data_preprocessing()
+    list_dummies = [col + "_" + str(category) for col, categories in dummies.items() for category in categories]
+    created_columns = [col for col in all_columns if col not in dummies] + list_dummies
+    created_columns = [col for col in created_columns if col not in ALIGNING_DROP] + ['DAYS_EMPLOYED_ANOM']
+    created_columns += [name for name in poly_names if name not in created_columns]
+    created_columns += [name for name, _, _ in DOMAIN_FEATURES]
+    target_position = created_columns.index("TARGET") if "TARGET" in created_columns else None
+    if columns is None:
+        columns = [col for col in created_columns if col != "TARGET"]
+
+    # Value of the columns expected but not created: 0 for a category never seen, nan otherwise
+    categ_columns = list(label_encoders) + list(dummies)
+    fill_values = {col: (0 if any(col.startswith(categ + "_") for categ in categ_columns) else np.nan)
+                   for col in columns if col not in created_columns}
+
+    return {"numeric_columns": numeric_columns,
+            "label_encoders": label_encoders,
+            "dummies": dummies,
+            "medians": medians.to_dict(),
+            "poly_names": poly_names,
+            "poly_powers": poly_transformer.powers_.tolist(),
+            "columns": [col for col in columns if col != "TARGET"],
+            "target_position": target_position,
+            "fill_values": fill_values}
+
+
+# Compact memory layout
+# The float columns are stored in float32 when no value moves by more than atol (a relative tolerance would accept
+# every column, float32 keeps about 7 significant digits): the ratios and the amounts without many decimals are
+# converted, the large values with decimals (polynomial features...) stay in float64. The integer columns are stored in
+# the smallest integer type and the dummies of each categorical variable in one categorical column (one code per row
+# instead of one byte per category). expand_dummies() converts the float32 columns back to float64.
+# The original order of the columns is kept in df.attrs["columns"] (and in the metadata of the parquet and feather
+# files): expand_dummies() gives back the dummies in this order, just before the model.
+def compact_datas(df, dummies=None, atol=1e-6, verbose=True):
+    """
+    Reduce the memory used by a dataframe after preprocessing
+    :param df: dataframe after preprocessing
+    :param dummies: dict {categorical variable: list of categories} of the dummies columns to pack (pipeline["dummies"]
+    of fit_preprocessing()), None to keep the dummies columns
+    :param atol: (float) maximum absolute difference accepted between a float64 value and its float32 value, 0 to only
+    convert the columns without any change of value
+    :param verbose: if True print the memory used before and after
+    :return: compact dataframe, with the original order of the columns in df.attrs["columns"]
+    """
+    memory_before = df.memory_usage(deep=True).sum()
+    data = {}
+    packed = {}
+
+    # Dummies columns of each categorical variable, packed if there is at most one 1 per row
+    if dummies is not None:
+        for categ, categories in dummies.items():
+            group = [categ + "_" + str(category) for category in categories if categ + "_" + str(category) in df]
+            if not group:
+                continue
+            values = df[group].to_numpy()
+            if not np.isin(values, [0, 1]).all() or (values.sum(axis=1) > 1).any():
+                continue
+            codes = np.where(values.any(axis=1), values.argmax(axis=1), -1)
+            packed[group[0]] = (categ, pd.Categorical.from_codes(codes, categories=group))
+            for col in group[1:]:
+                packed[col] = None
+
+    for col in df:
+        if col in packed:
+            # The categorical column takes the place of the first dummies column of its group
+            if packed[col] is not None:
+                data[packed[col][0]] = packed[col][1]
+            continue
+        values = df[col]
+        if values.dtype == np.float64:
+            values_32 = values.astype(np.float32)
+            difference = np.abs(values_32.astype(np.float64) - values)
+            # The missing values (and the infinite values) are kept by the cast
+            if ((difference <= atol) | difference.isna()).all():
+                values = values_32
+        elif values.dtype.kind in "iu":
+            values = pd.to_numeric(values, downcast="integer" if values.dtype.kind == "i" else "unsigned")
+        data[col] = values
+    df_compact = pd.DataFrame(data, index=df.index)
+    df_compact.attrs["columns"] = list(df.columns)
+
+    if verbose:
+        memory_after = df_compact.memory_usage(deep=True).sum()
+        print("Memory: %.1f MB -> %.1f MB" % (memory_before / 1e6, memory_after / 1e6))
+    return df_compact
+
+
+def expand_dummies(df, columns=None):
     """
-    Export a dataframe into a csv file
+    Expand the categorical columns of compact_datas() to dummies columns, in the original order of the columns
+    :param df: compact dataframe
+    :param columns: list of the columns in their original order, None for df.attrs["columns"] (the columns missing from
+    df are skipped, without it the dummies of a variable are put at the place of its categorical column)
+    :return: dataframe with the dummies columns (uint8) and the float columns in float64
+    """
+    list_columns = []
+    for col in df:
+        if pd.api.types.is_categorical_dtype(df[col]):
+            codes = df[col].cat.codes.to_numpy()
+            list_columns += [pd.Series((codes == i).astype(np.uint8), index=df.index, name=name)
+                             for i, name in enumerate(df[col].cat.categories)]
+        elif df[col].dtype == np.float32:
+            # Back to float64 before the rounding of data_for_api() (0.79 and not 0.7900000214576721)
+            list_columns.append(df[col].astype(np.float64))
+        else:
+            list_columns.append(df[col])
+    df_expanded = pd.concat(list_columns, axis=1)
+
+    if columns is None:
+        columns = df.attrs.get("columns")
+    if columns is not None:
+        df_expanded = df_expanded[[col for col in columns if col in df_expanded]]
+    return df_expanded
+
+
+def export_datas(df, name_python_file="P7_preprocessing.py", name_file_out=None, path_folder_out=None, append=False,
+                 file_format=None):
+    """
+    Export a dataframe into a data file (csv, parquet or feather)
     :param df: dataframe to export
     :param name_python_file: (str) name of the current python file
-    :param name_file_out: (str) name of the csv file to export
-    :param path_folder_out: (str) path to the folder to export the csv file
+    :param name_file_out: (str) name of the data file to export
+    :param path_folder_out: (str) path to the folder to export the data file
+    :param append: if True the rows are added at the end of the data file, without header (only for csv files)
+    :param file_format: (str) "csv", "parquet" or "feather", if None the format is given by the extension of the file
+    :return: no return
+    """
+    if path_folder_out is None:
+        write_datas(df, name_file_out, file_format=file_format, append=append)
+    else:
+        path_python_file = str(pathlib.Path(name_python_file).parent.resolve())
+        write_datas(df, path_python_file + "\\" + path_folder_out + "\\" + name_file_out, file_format=file_format,
+                    append=append)
+
+
+def export_artifact(obj, name_python_file="P7_preprocessing.py", name_file_out=None, path_folder_out=None):
+    """
+    Export a python object (dict of arrays, fitted objects...) into a pickle file
+    :param obj: object to export
+    :param name_python_file: (str) name of the current python file
+    :param name_file_out: (str) name of the pickle file to export
+    :param path_folder_out: (str) path to the folder to export the pickle file
     :return: no return
     """
     if path_folder_out is None:
-        df.to_csv(name_file_out)
+        joblib.dump(obj, name_file_out)
     else:
         path_python_file = str(pathlib.Path(name_python_file).parent.resolve())
-        df.to_csv(path_python_file + "\\" + path_folder_out + "\\" + name_file_out)
+        joblib.dump(obj, path_python_file + "\\" + path_folder_out + "\\" + name_file_out)
+
+
+def export_feature_matrix(df, name_python_file="P7_preprocessing.py", name_file_out=None, name_index_out=None,
+                          path_folder_out=None, name_data_file=None):
+    """
+    Export the features of the customers in a float32 numpy file (one row per customer, contiguous) read with a memory
+    map by the API, and its index (SK_ID_CURR of each row, columns and hash of the data file) in a pickle file
+    :param df: dataframe after preprocessing (with SK_ID_CURR)
+    :param name_python_file: (str) name of the current python file
+    :param name_file_out: (str) name of the numpy file (.npy) to export
+    :param name_index_out: (str) name of the pickle file of the index to export
+    :param path_folder_out: (str) path to the folder to export the files
+    :param name_data_file: (str) path of the data file of the same customers, its hash tags the feature matrix
+    :return: no return
+    """
+    X = df.drop(columns=["SK_ID_CURR", "TARGET"], errors="ignore")
+    index = {"SK_ID_CURR": df["SK_ID_CURR"].to_numpy(dtype=np.int64),
+             "columns": list(X.columns),
+             "data_hash": None if name_data_file is None else file_digest(name_data_file)}
+    features = np.ascontiguousarray(X.to_numpy(dtype=np.float32))
+
+    path_file_out = name_file_out
+    if path_folder_out is not None:
+        path_python_file = str(pathlib.Path(name_python_file).parent.resolve())
+        path_file_out = path_python_file + "\\" + path_folder_out + "\\" + name_file_out
+    np.save(path_file_out, features)
+    export_artifact(index, name_python_file=name_python_file, name_file_out=name_index_out,
+                    path_folder_out=path_folder_out)
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Calculate the sha256 hash of a file without loading it entirely in memory
+    :param path: (str) path of the file
+    :param chunk_size: (int) number of bytes read at each step
+    :return: (str) hexadecimal digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parallel_apply(func, df, n_jobs=1, **kwargs):
+    """
+    Apply a function to parts of the rows of a dataframe in n_jobs processes, for the functions that transform each row
+    independently of the others (already fitted). The results are concatenated in the order of the rows of df.
+    The function has to be defined at the top level of a module and the script protected by if __name__ == "__main__".
+    :param func: function taking a dataframe and returning a dataframe with the same rows
+    :param df: dataframe
+    :param n_jobs: (int) number of processes, -1 for the number of CPU, 1 to apply func in the current process
+    :param kwargs: other arguments of func
+    :return: dataframe of the results
+    """
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if n_jobs is None or n_jobs <= 1 or len(df) < 2:
+        return func(df, **kwargs)
+
+    list_positions = [positions for positions in np.array_split(np.arange(len(df)), n_jobs) if len(positions)]
+    with ProcessPoolExecutor(max_workers=len(list_positions)) as executor:
+        list_results = list(executor.map(partial(func, **kwargs), [df.iloc[positions] for positions in list_positions]))
+    return pd.concat(list_results)
 
 
 def data_preprocessing(name_file_in=None, name_file_out=None, path_folder_out=None, sampling=1, return_df=False,
-                       export_csv=True, name_data_directory="P7_data", name_python_file="P7_preprocessing.py"):
+                       export_csv=True, name_data_directory="P7_data", name_python_file="P7_preprocessing.py",
+                       chunksize=None, pipeline=None, n_jobs=1):
     """
     Apply all the previous functions
     :param name_file_in: (str) name of the csv file to load
@@ -188,15 +585,50 @@ def data_preprocessing(name_file_in=None, name_file_out=None, path_folder_out=No
     :param export_csv: if True export a csv file
     :param name_data_directory: (str) name of the directory where the csv file to upload is
     :param name_python_file: (str) name of the current python file
+    :param chunksize: (int) if not None, the csv file is read, preprocessed and exported by chunks of chunksize rows
+    with a fitted preprocessing, so the memory used does not depend on the size of the file (if return_df is False).
+    The chunks are appended to the exported file: only a csv file can be exported with chunksize
+    :param pipeline: dict of the fitted preprocessing used with chunksize (fit_preprocessing()), if None it is fitted
+    on the csv file read a first time by chunks
+    :param n_jobs: (int) number of processes (see parallel_apply()): the preprocessing is fitted on all the rows and
+    applied to parts of the rows at the same time (without chunksize)
     :return: dataframe of the results if return_df is True
     """
 
+    if chunksize is not None:
+        # Checked before reading the file: a parquet or feather file can not be appended after the first chunk
+        if export_csv is True and file_format_of(name_file_out) != "csv":
+            raise ValueError("chunksize is only available for csv files: " + str(name_file_out))
+        if pipeline is None:
+            pipeline = fit_preprocessing(load_data(name_file=name_file_in, name_file_directory=name_data_directory,
+                                                   name_python_file=name_python_file, chunksize=chunksize))
+        list_df = []
+        for i, df_chunk in enumerate(load_data(name_file=name_file_in, name_file_directory=name_data_directory,
+                                               name_python_file=name_python_file, chunksize=chunksize)):
+            if 1 > sampling > 0:
+                df_chunk = df_chunk.sample(frac=sampling)
+            df_chunk = transform_frame(df_chunk, pipeline)
+            if export_csv is True:
+                export_datas(df_chunk, name_file_out=name_file_out, path_folder_out=path_folder_out,
+                             name_python_file=name_python_file, append=i > 0)
+            if return_df is True:
+                list_df.append(df_chunk)
+        if return_df is True:
+            return pd.concat(list_df)
+        return
+
     df = load_data(name_file=name_file_in, name_file_directory=name_data_directory, name_python_file=name_python_file)
-    df = encoding(df)
-    df = aligning(df)
-    if 1 > sampling > 0:
-        df = df.sample(frac=sampling)
-    df = feature_engineering(df)
+    if n_jobs != 1:
+        pipeline = fit_preprocessing(df) if pipeline is None else pipeline
+        if 1 > sampling > 0:
+            df = df.sample(frac=sampling)
+        df = parallel_apply(transform_frame, df, n_jobs=n_jobs, pipeline=pipeline)
+    else:
+        df = encoding(df)
+        df = aligning(df)
+        if 1 > sampling > 0:
+            df = df.sample(frac=sampling)
+        df = feature_engineering(df)
     if export_csv is True:
         export_datas(df, name_file_out=name_file_out, path_folder_out=path_folder_out,
                      name_python_file=name_python_file)
@@ -1,23 +1,102 @@
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+
 from P7_functions.P7_functions_preprocessing import *
 from P7_functions.P7_functions_ML import *
 from P7_functions.P7_functions_comparison_data import *
 from P7_functions.P7_functions_data_for_API import *
 
-# Preprocessing new customer
-data_preprocessing(name_file_in="application_test.csv",
-                   name_file_out="data_new_customer.csv", path_folder_out="P7_API\\data",
-                   sampling=1, return_df=False, export_csv=True,
-                   name_data_directory="P7_data", name_python_file="P7_preprocessing.py")
-
-# Preprocessing former customer
-data_former_customer = data_preprocessing(name_file_in="application_train.csv",
-                                          name_file_out=None, path_folder_out=None,
-                                          sampling=1, return_df=True, export_csv=False,
-                                          name_data_directory="P7_data", name_python_file="P7_preprocessing.py")
-# Calculate comparison data from former customer
-data_former_customer = lgbm_scoring_prediction(data_former_customer, name_model_file="model_lgbm.pkl")
-data_former_customer = data_for_api(data_former_customer)
-comparison_data = calc_comparison_data(data_former_customer,
-                                       list_var=["AMT_CREDIT", "DAYS_BIRTH", "ANNUITY_INCOME_PERCENT"])
-export_datas(comparison_data, name_file_out="comparison_data.csv", path_folder_out="P7_Dashboard",
-             name_python_file="P7_preprocessing.py")
\ No newline at end of file
+# Number of processes used by the whole script, shared by the two branches (new and former customers) running at the
+# same time. 1 to run everything in one process.
+N_JOBS = os.cpu_count()
+
+
+def scoring_for_api(df, name_model_file="model_lgbm.pkl"):
+    """
+    Score the customers and keep the data of the API (applied in parallel on parts of the rows)
+    :param df: dataframe after preprocessing
+    :param name_model_file: name of the model (pickel file .pkl)
+    :return: dataframe of the API
+    """
+    return data_for_api(lgbm_scoring_prediction(df, name_model_file=name_model_file))
+
+
+def preprocessing_new_customer(n_jobs=1):
+    """
+    Preprocessing of the new customers, their scores and shapley values and the preprocessing of new applications,
+    exported for the API
+    :param n_jobs: (int) number of processes
+    :return: no return
+    """
+    # Preprocessing new customer
+    data_new_customer = data_preprocessing(name_file_in="application_test.csv",
+                                           name_file_out=None, path_folder_out=None,
+                                           sampling=1, return_df=True, export_csv=False,
+                                           name_data_directory="P7_data", name_python_file="P7_preprocessing.py",
+                                           n_jobs=n_jobs)
+
+    # Preprocessing fitted once on the former customers, with the columns of the model, for the scoring of new
+    # applications in the API
+    preprocessing_pipeline = fit_preprocessing(load_data(name_file="application_train.csv",
+                                                         name_file_directory="P7_data",
+                                                         name_python_file="P7_preprocessing.py"),
+                                               columns=list(data_new_customer.columns))
+    export_artifact(preprocessing_pipeline, name_file_out="preprocessing_pipeline.pkl",
+                    path_folder_out="P7_API\\data", name_python_file="P7_preprocessing.py")
+
+    # Data of the new customers exported in a compact layout for the API
+    export_datas(compact_datas(data_new_customer, dummies=preprocessing_pipeline["dummies"]),
+                 name_file_out="data_new_customer.parquet", path_folder_out="P7_API\\data",
+                 name_python_file="P7_preprocessing.py")
+
+    # Features of the new customers in a float32 matrix shared by the workers of the API (memory map)
+    path_python_file = str(pathlib.Path("P7_preprocessing.py").parent.resolve())
+    export_feature_matrix(data_new_customer, name_file_out="features_new_customer.npy",
+                          name_index_out="features_new_customer_index.pkl", path_folder_out="P7_API\\data",
+                          name_data_file=path_python_file + "\\P7_API\\data\\data_new_customer.parquet",
+                          name_python_file="P7_preprocessing.py")
+
+    # Scores and shapley values of the new customers, served by the API without computation
+    precomputed_results = precompute_scores_shap(data_new_customer, name_model_file="model_lgbm.pkl",
+                                                 name_data_file=path_python_file +
+                                                 "\\P7_API\\data\\data_new_customer.parquet",
+                                                 n_jobs=n_jobs)
+    export_artifact(precomputed_results, name_file_out="precomputed_results.pkl", path_folder_out="P7_API\\data",
+                    name_python_file="P7_preprocessing.py")
+
+
+def preprocessing_former_customer(n_jobs=1):
+    """
+    Preprocessing and scoring of the former customers and comparison data exported for the dashboard
+    :param n_jobs: (int) number of processes
+    :return: no return
+    """
+    # Preprocessing former customer
+    data_former_customer = data_preprocessing(name_file_in="application_train.csv",
+                                              name_file_out=None, path_folder_out=None,
+                                              sampling=1, return_df=True, export_csv=False,
+                                              name_data_directory="P7_data", name_python_file="P7_preprocessing.py",
+                                              n_jobs=n_jobs)
+    # Calculate comparison data from former customer
+    data_former_customer = parallel_apply(scoring_for_api, data_former_customer, n_jobs=n_jobs,
+                                          name_model_file="model_lgbm.pkl")
+    comparison_data = calc_comparison_data(data_former_customer,
+                                           list_var=["AMT_CREDIT", "DAYS_BIRTH", "ANNUITY_INCOME_PERCENT"])
+    export_datas(comparison_data, name_file_out="comparison_data.parquet", path_folder_out="P7_Dashboard",
+                 name_python_file="P7_preprocessing.py")
+
+
+# The processes started by the script import it again (Windows): the computation is only run by the main process
+if __name__ == "__main__":
+    if N_JOBS == 1:
+        preprocessing_new_customer()
+        preprocessing_former_customer()
+    else:
+        # The two branches are independent: they run at the same time, each with half of the processes
+        n_jobs_branch = max(1, N_JOBS // 2)
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            branches = [executor.submit(preprocessing_new_customer, n_jobs=n_jobs_branch),
+                        executor.submit(preprocessing_former_customer, n_jobs=n_jobs_branch)]
+            for branch in branches:
+                branch.result()
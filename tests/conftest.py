@@ -0,0 +1,55 @@
+import pathlib
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The tests are run from the root of the repository (python -m pytest).
+# P7_functions imports the modules shared with the API as P7_API.functions...: the folder P7_API is imported first as a
+# package, then added to the path for the modules of the API (imported as functions...). With the folder P7_API in
+# the path before, P7_API.py would hide the package.
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import P7_API.functions  # noqa: E402, F401
+sys.path.insert(1, str(ROOT / "P7_API"))
+
+
+@pytest.fixture
+def raw_applications():
+    """
+    Raw applications with the columns of application_train.csv used by the preprocessing: amounts, days (with the
+    anomalous value 365243 of DAYS_EMPLOYED), sources and categorical variables (with missing values, and the
+    categories removed by aligning())
+    :return: dataframe of 200 applications
+    """
+    rng = np.random.default_rng(0)
+    n = 200
+
+    def with_nan(values, ratio=0.1):
+        values = values.astype(object if values.dtype.kind in "OU" else np.float64)
+        values[rng.random(n) < ratio] = None if values.dtype == object else np.nan
+        return values
+
+    days_employed = -rng.integers(0, 15000, n).astype(np.float64)
+    days_employed[rng.random(n) < 0.1] = 365243
+    family_status = with_nan(rng.choice(["Married", "Single / not married", "Widow"], n))
+    family_status[0] = "Unknown"
+    income_type = rng.choice(["Working", "Pensioner", "State servant"], n).astype(object)
+    income_type[1] = "Maternity leave"
+    return pd.DataFrame({"SK_ID_CURR": np.arange(100001, 100001 + n),
+                         "NAME_CONTRACT_TYPE": rng.choice(["Cash loans", "Revolving loans"], n).astype(object),
+                         "CODE_GENDER": rng.choice(["F", "M", "XNA"], n, p=[0.6, 0.38, 0.02]).astype(object),
+                         "NAME_FAMILY_STATUS": family_status,
+                         "NAME_INCOME_TYPE": income_type,
+                         "CNT_CHILDREN": rng.integers(0, 4, n),
+                         "AMT_INCOME_TOTAL": rng.uniform(30000, 400000, n).round(1),
+                         "AMT_CREDIT": rng.uniform(45000, 2000000, n).round(1),
+                         "AMT_ANNUITY": with_nan(rng.uniform(2000, 100000, n).round(1), ratio=0.02),
+                         "AMT_GOODS_PRICE": with_nan(rng.uniform(40000, 2000000, n).round(1), ratio=0.02),
+                         "REGION_POPULATION_RELATIVE": rng.choice([0.00702, 0.0188, 0.035792, 0.072508], n),
+                         "DAYS_BIRTH": -rng.integers(7500, 25000, n),
+                         "DAYS_EMPLOYED": days_employed,
+                         "EXT_SOURCE_1": with_nan(rng.uniform(0, 1, n), ratio=0.4),
+                         "EXT_SOURCE_2": with_nan(rng.uniform(0, 1, n), ratio=0.01),
+                         "EXT_SOURCE_3": with_nan(rng.uniform(0, 1, n), ratio=0.2)})
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("sklearn")
+from P7_functions.P7_functions_preprocessing import (aligning, compact_datas, encoding, expand_dummies,  # noqa: E402
+                                                     feature_engineering, fit_preprocessing, transform_frame,
+                                                     write_datas)
+from P7_API.functions.P7_functions_transform import transform_record  # noqa: E402
+
+
+def records_of(df):
+    """
+    :param df: dataframe of raw applications
+    :return: list of dict, the missing values are None (json of the API)
+    """
+    return [{col: (None if pd.isna(value) else value) for col, value in record.items()}
+            for record in df.to_dict("records")]
+
+
+def test_transform_frame_same_as_preprocessing(raw_applications):
+    df_legacy = feature_engineering(aligning(encoding(raw_applications.copy())))
+    df_transformed = transform_frame(raw_applications, fit_preprocessing(raw_applications))
+
+    assert list(df_transformed.columns) == list(df_legacy.columns)
+    np.testing.assert_allclose(df_transformed.to_numpy(dtype=np.float64), df_legacy.to_numpy(dtype=np.float64),
+                               rtol=1e-12)
+
+
+def test_transform_record_same_as_transform_frame(raw_applications):
+    pipeline = fit_preprocessing(raw_applications)
+    df_transformed = transform_frame(raw_applications, pipeline)
+    rows = [transform_record(record, pipeline) for record in records_of(raw_applications)]
+
+    np.testing.assert_allclose(np.array(rows, dtype=np.float64),
+                               df_transformed[pipeline["columns"]].to_numpy(dtype=np.float64), rtol=1e-12)
+
+
+def test_transform_record_missing_fields(raw_applications):
+    pipeline = fit_preprocessing(raw_applications)
+    record = records_of(raw_applications.head(1))[0]
+    del record["EXT_SOURCE_1"], record["NAME_FAMILY_STATUS"]
+
+    row = transform_record(record, pipeline)
+    expected = transform_frame(raw_applications.head(1).drop(columns=["EXT_SOURCE_1"]).assign(NAME_FAMILY_STATUS=None),
+                               pipeline)
+    np.testing.assert_allclose(np.array(row, dtype=np.float64),
+                               expected[pipeline["columns"]].to_numpy(dtype=np.float64)[0], rtol=1e-12)
+
+
+def compact_of(raw_applications):
+    """
+    :param raw_applications: dataframe of raw applications
+    :return: tuple (dataframe after preprocessing, compact dataframe)
+    """
+    pipeline = fit_preprocessing(raw_applications)
+    df = transform_frame(raw_applications, pipeline)
+    return df, compact_datas(df, dummies=pipeline["dummies"], verbose=False)
+
+
+def assert_same_as_preprocessed(df_expanded, df):
+    """
+    The expanded dataframe has the columns of the preprocessed one in the same order, its values up to the float32
+    conversion of compact_datas(), its float columns in float64 and its dummies in uint8
+    """
+    assert list(df_expanded.columns) == list(df.columns)
+    np.testing.assert_allclose(df_expanded.to_numpy(dtype=np.float64), df.to_numpy(dtype=np.float64),
+                               rtol=0, atol=1e-6)
+    assert set(df_expanded.select_dtypes("float").dtypes) == {np.dtype(np.float64)}
+    assert (df_expanded.filter(like="CODE_GENDER_").dtypes == np.uint8).all()
+
+
+def test_compact_expand_round_trip(raw_applications):
+    df, df_compact = compact_of(raw_applications)
+    assert df_compact.memory_usage(deep=True).sum() < df.memory_usage(deep=True).sum()
+    assert "CODE_GENDER" in df_compact and "CODE_GENDER_F" not in df_compact
+    # float32 only if no value moves by more than 1e-6
+    assert df_compact["EXT_SOURCE_2"].dtype == np.float32
+    assert df_compact["AMT_INCOME_TOTAL"].dtype == np.float64
+
+    assert_same_as_preprocessed(expand_dummies(df_compact), df)
+
+
+def test_compact_expand_round_trip_parquet(raw_applications, tmp_path):
+    pytest.importorskip("pyarrow")
+    from functions.P7_functions_store import read_datas, expand_dummies as expand_dummies_api
+
+    # Through the data file read by the API: the order of the columns is kept in the metadata of the file
+    df, df_compact = compact_of(raw_applications)
+    path_file = str(tmp_path / "data_new_customer.parquet")
+    write_datas(df_compact, path_file)
+
+    assert_same_as_preprocessed(expand_dummies_api(read_datas(path_file)), df)
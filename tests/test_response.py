@@ -0,0 +1,63 @@
+import pytest
+
+flask = pytest.importorskip("flask")
+pytest.importorskip("orjson")
+from functions.P7_functions_response import PayloadCache, json_response  # noqa: E402
+
+VERSION = ("v1", "model hash", "data hash")
+
+
+def make_app(payload_cache, calls):
+    """
+    Route of the API serving the cached json of a customer with its etag
+    :param payload_cache: PayloadCache
+    :param calls: list of the customer ids of the responses built (not served by the cache)
+    :return: flask application
+    """
+    app = flask.Flask(__name__)
+
+    @app.route("/api/customer/<int:customer_id>/")
+    def get_customer(customer_id):
+        def build():
+            calls.append(customer_id)
+            return {customer_id: {"SCORING_PREDICT": 42.0, "AMT_CREDIT": customer_id * 10.0}}
+
+        payload_cache.set_version(VERSION)
+        body, etag = payload_cache.get_or_build(("/api/customer/", customer_id), build)
+        return json_response(body, etag)
+
+    return app
+
+
+def test_etag_not_modified():
+    calls = []
+    client = make_app(PayloadCache(), calls).test_client()
+
+    response = client.get("/api/customer/100001/")
+    assert response.status_code == 200
+    assert response.get_json() == {"100001": {"SCORING_PREDICT": 42.0, "AMT_CREDIT": 1000010.0}}
+    etag = response.headers["ETag"]
+
+    # Same json: 304 without body, built once
+    response = client.get("/api/customer/100001/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert calls == [100001]
+
+    # An other customer has an other etag
+    response = client.get("/api/customer/100002/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_etag_shared_by_workers(tmp_path):
+    # Two workers sharing the SQLite file: the second one serves the response of the first one, with the same etag
+    path = str(tmp_path / "payload_cache.sqlite")
+    calls = []
+    first = make_app(PayloadCache(path=path), calls).test_client()
+    second = make_app(PayloadCache(path=path), calls).test_client()
+
+    etag = first.get("/api/customer/100001/").headers["ETag"]
+    response = second.get("/api/customer/100001/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert calls == [100001]
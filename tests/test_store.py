@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from functions.P7_functions_store import CustomerStore
+
+CUSTOMER_IDS = [5, 12, 100, 101, 105, 1000, 1001, 1200, 2000, 100001]
+
+
+@pytest.fixture
+def customer_store(tmp_path):
+    """
+    :return: CustomerStore of a csv file of the ids CUSTOMER_IDS (in a random order)
+    """
+    ids = np.random.default_rng(0).permutation(CUSTOMER_IDS)
+    path_file = str(tmp_path / "data_new_customer.csv")
+    pd.DataFrame({"SK_ID_CURR": ids, "AMT_CREDIT": ids * 10.0}).to_csv(path_file, index=False)
+    return CustomerStore(path_file)
+
+
+def all_pages(customer_store, limit, **kwargs):
+    """
+    :return: tuple (list of the totals of the pages, ids of all the pages one after the other)
+    """
+    totals, ids = [], []
+    for offset in range(0, len(CUSTOMER_IDS) + limit, limit):
+        total, page = customer_store.search(limit=limit, offset=offset, **kwargs)
+        assert len(page) <= limit
+        totals.append(total)
+        ids += page
+    return totals, ids
+
+
+def test_search_all_ids(customer_store):
+    total, page = customer_store.search(limit=3)
+    assert total == len(CUSTOMER_IDS)
+    assert page == [5, 12, 100]
+    assert all_pages(customer_store, limit=3)[1] == CUSTOMER_IDS
+
+
+def test_search_prefix_pages(customer_store):
+    # Increasing ids, the shorter ids first
+    expected = [12, 100, 101, 105, 1000, 1001, 1200, 100001]
+    totals, ids = all_pages(customer_store, limit=3, prefix="1")
+    assert set(totals) == {len(expected)}
+    assert ids == expected
+
+
+def test_search_prefix_and_range(customer_store):
+    assert customer_store.search(prefix="10", id_min=101, id_max=1000) == (3, [101, 105, 1000])
+    assert customer_store.search(prefix="10", id_min=101, id_max=1000, limit=2, offset=2) == (3, [1000])
+
+
+def test_search_empty(customer_store):
+    # Range inverted, prefix of no id and offset after the last id
+    assert customer_store.search(id_min=1000, id_max=100) == (0, [])
+    assert customer_store.search(prefix="3") == (0, [])
+    assert customer_store.search(prefix="1", offset=50) == (8, [])